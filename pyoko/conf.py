@@ -9,37 +9,76 @@
 
 import importlib
 import os
+import threading
 
 
 class Settings(object):
     def __init__(self):
         """
-        Proxy object for both static and dynamic app settings
+        Proxy object for both static and dynamic app settings.
+
+        Settings module is imported on first access to a setting,
+        so importing pyoko doesn't require the settings to be ready.
         :return:
         """
-        self.DEBUG = bool(os.environ.get('DEBUG'))
-        self.DEBUG_LEVEL = int(os.environ.get('DEBUG_LEVEL', 0))
-        self.SEARCH_INDEXES = {}
-        self.CATALOG_DATA_MANAGER = "pyoko.lib.utils.simple_choices_manager"
-        self.FILE_MANAGER = "pyoko.lib.utils.SimpleRiakFileManager"
-        self.DATE_DEFAULT_FORMAT = ""
-        self.DATETIME_DEFAULT_FORMAT = ""
-        self.SETTINGS_MODULE = os.environ.get('PYOKO_SETTINGS')
-        self.MODELS_MODULE = '.'.join(
-            self.SETTINGS_MODULE.split('.')[:1]) + '.models'
+        self._loaded = False
+        self._loading = False
+        # reentrant, settings module may access the settings while it's imported
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        # only called for attributes that are not set yet
+        if self.__dict__.get('_loaded', True):
+            raise AttributeError(name)
+        with self._lock:
+            # other threads wait till all settings are assigned,
+            # the loading thread itself gets an AttributeError
+            if not self._loaded:
+                if self._loading:
+                    raise AttributeError(name)
+                self._loading = True
+                try:
+                    self._setup()
+                finally:
+                    self._loading = False
+        return getattr(self, name)
 
+    def _setup(self):
+        """
+        Loads default settings of pyoko, then the ones of the
+        settings module given in PYOKO_SETTINGS environment variable.
+
+        Settings are collected first, then assigned at once, so
+        they're never seen partially loaded.
+        """
+        values = {
+            'DEBUG': bool(os.environ.get('DEBUG')),
+            'DEBUG_LEVEL': int(os.environ.get('DEBUG_LEVEL', 0)),
+            'SEARCH_INDEXES': {},
+            'CATALOG_DATA_MANAGER': "pyoko.lib.utils.simple_choices_manager",
+            'FILE_MANAGER': "pyoko.lib.utils.SimpleRiakFileManager",
+            'DATE_DEFAULT_FORMAT': "",
+            'DATETIME_DEFAULT_FORMAT': "",
+        }
+        values['SETTINGS_MODULE'] = settings_module = os.environ.get('PYOKO_SETTINGS')
         try:
-            mod = importlib.import_module(self.SETTINGS_MODULE)
-        except ImportError as e:
+            values['MODELS_MODULE'] = '.'.join(
+                settings_module.split('.')[:1]) + '.models'
+            modules = [importlib.import_module('pyoko.settings'),
+                       importlib.import_module(settings_module)]
+        except (ImportError, AttributeError) as e:
+            # settings will be loaded again on next access
             raise ImportError(
                 "Could not import settings '%s' (Is it on sys.path? "
                 "Is there an import error in the settings file?): %s"
-                % (self.SETTINGS_MODULE, e)
+                % (settings_module, e)
             )
-        for setting in dir(mod):
-            if setting.isupper():
-                setting_value = getattr(mod, setting)
-                setattr(self, setting, setting_value)
+        for mod in modules:
+            for setting in dir(mod):
+                if setting.isupper():
+                    values[setting] = getattr(mod, setting)
+        self.__dict__.update(values)
+        self._loaded = True
         if self.DEBUG:
             import sys
             # Will be used to store solr query logs
@@ -7,18 +7,8 @@ this module contains a base class for other db access classes
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
-from collections import defaultdict
 from enum import Enum
-import sys
 ReturnType = Enum('ReturnType', 'Solr Object Model')
-sys.PYOKO_STAT_COUNTER = {
-    "save": 0,
-    "update": 0,
-    "read": 0,
-    "count": 0,
-    "search": 0,
-}
-sys.PYOKO_LOGS = defaultdict(list)
 
 class BaseAdapter(object):
     """
@@ -7,10 +7,6 @@ this module contains a base class for other db access classes
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
-from collections import defaultdict
-
-import copy
-
 # noinspection PyCompatibility
 import json
 from datetime import date, timedelta
@@ -29,26 +25,160 @@ except ImportError:
 from enum import Enum
 import six
 from pyoko.conf import settings
-from pyoko.db.connection import client, cache, log_bucket, version_bucket
+from pyoko.db.connection import client, cache, log_bucket, version_bucket, ProcessLocal, \
+    fetch_pool
+from pyoko.db.cache import cache_writer, cache_stats
+from pyoko.db import instrumentation as ins
+from pyoko.db.instrumentation import instrumentation
 import riak
-from pyoko.exceptions import MultipleObjectsReturned, ObjectDoesNotExist, PyokoError
+from pyoko.exceptions import MultipleObjectsReturned, ObjectDoesNotExist, PyokoError, \
+    NotCompatible, IndexSyncTimeout
 import traceback
 import ast
+import logging
+from multiprocessing.pool import ThreadPool
+from collections import deque
+from contextlib import closing
 
 # TODO: Add OR support
 
-import sys
-
 ReturnType = Enum('ReturnType', 'Solr Object Model')
 
-sys.PYOKO_STAT_COUNTER = {
-    "save": 0,
-    "update": 0,
-    "read": 0,
-    "count": 0,
-    "search": 0,
-}
-sys.PYOKO_LOGS = defaultdict(list)
+log = logging.getLogger(__name__)
+
+# $key index range that covers all keys, used by scans
+SCAN_START_KEY = u'\x00'
+SCAN_END_KEY = u'\U0010ffff'
+
+# model class name => set of fields that stored in Solr
+STORED_FIELDS = {}
+
+# special characters of Solr query syntax, "&&" and "||" are handled separately
+ESCAPE_TABLE = dict((ord(c), u'\\' + c) for c in '+-!(){}[]^"~*?: ')
+
+# query key suffixes and their modifiers, in the order they're checked
+QUERY_MODIFIERS = (('__contains', 'contains'),
+                   ('__range', 'range'),
+                   ('__startswith', 'startswith'),
+                   ('__endswith', 'endswith'),
+                   ('__lt', 'lt'),
+                   ('__gt', 'gt'),
+                   ('__lte', 'lte'),
+                   ('__gte', 'gte'))
+
+# types that are always of "value" kind, see _value_kind()
+PLAIN_VALUE_TYPES = frozenset((six.text_type, six.binary_type, int, float, bool, list, tuple))
+
+# query shape => (renderers of query parts, sets want_deleted)
+QUERY_PLANS = {}
+
+
+def _value_kind(val):
+    """
+    Returns the kind of a query value, as far as it affects the compiled query
+    other than the value itself.
+    """
+    if val.__class__ in PLAIN_VALUE_TYPES:
+        return 'value'
+    if isinstance(val, date):
+        return 'date'
+    if hasattr(val, '_TYPE'):
+        return 'model' if val.key is not None else 'empty_model'
+    if val is None:
+        return 'empty'
+    if isinstance(val, dict):
+        return tuple((k, _value_kind(v)) for k, v in val.items())
+    return 'value'
+
+
+class IndexWaiter(object):
+    """
+    Waits till given keys become visible in (or disappear from) results of a queryset.
+
+    Only the keys not yet seen are checked on each poll, and polling
+    interval grows exponentially from ``settings.INDEX_WAIT_MIN_DELAY``
+    to ``settings.INDEX_WAIT_MAX_DELAY``.
+
+    Observed indexing lags are collected in ``IndexWaiter.stats``.
+
+    Args:
+        queryset (QuerySet): Queryset to look for the keys in.
+        keys (list): Object keys.
+        query_dict (dict): Additional filters that the objects should match.
+        deleted (bool): Wait for keys to disappear instead of appearing. Since
+            deleted objects are filtered out by default, this is used to wait deletions.
+        timeout (float): Max seconds to wait. Defaults to ``settings.INDEX_WAIT_TIMEOUT``.
+    """
+    # max number of keys to check in one query
+    CHUNK_SIZE = 500
+    stats = {
+        'count': 0,
+        'total_lag': 0.0,
+        'max_lag': 0.0,
+        'last_lag': 0.0,
+        'polls': 0,
+        'timeouts': 0,
+    }
+
+    def __init__(self, queryset, keys, query_dict=None, deleted=False, timeout=None):
+        self.queryset = queryset
+        self.pending = set(keys)
+        self.size = len(self.pending)
+        self.query_dict = query_dict or {}
+        self.deleted = deleted
+        self.timeout = settings.INDEX_WAIT_TIMEOUT if timeout is None else timeout
+        self.lag = 0.0
+
+    def _poll(self):
+        pending = list(self.pending)
+        visible = set()
+        for i in range(0, len(pending), self.CHUNK_SIZE):
+            chunk = pending[i:i + self.CHUNK_SIZE]
+            visible.update(self.queryset.filter(key__in=chunk, **self.query_dict).set_params(
+                rows=len(chunk)).values_list('key', from_solr=True))
+        if self.deleted:
+            self.pending &= visible
+        else:
+            self.pending -= visible
+        self.stats['polls'] += 1
+
+    def wait(self, raise_on_timeout=True):
+        """
+        Blocks till all keys become visible or timeout expires.
+
+        Args:
+            raise_on_timeout (bool): Raise IndexSyncTimeout if timeout expires.
+
+        Returns:
+            Seconds waited.
+
+        Raises:
+            IndexSyncTimeout: If some of the keys are still pending after timeout.
+        """
+        t1 = time.time()
+        deadline = t1 + self.timeout
+        delay = settings.INDEX_WAIT_MIN_DELAY
+        while self.pending:
+            self._poll()
+            if not self.pending:
+                break
+            if time.time() + delay > deadline:
+                self.stats['timeouts'] += 1
+                if raise_on_timeout:
+                    raise IndexSyncTimeout("%s key(s) not synced to %s after %s seconds: %s" % (
+                        len(self.pending), self.queryset.adapter.index_name,
+                        self.timeout, list(self.pending)[:10]))
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, settings.INDEX_WAIT_MAX_DELAY)
+        self.lag = time.time() - t1
+        self.stats['count'] += 1
+        self.stats['total_lag'] += self.lag
+        self.stats['last_lag'] = self.lag
+        self.stats['max_lag'] = max(self.stats['max_lag'], self.lag)
+        instrumentation.emit(ins.INDEX_WAIT, self.queryset._model_class.__name__, self.lag,
+                             self.size, deleted=self.deleted)
+        return self.lag
 
 
 class BlockSave(object):
@@ -60,14 +190,14 @@ class BlockSave(object):
         Adapter.block_saved_keys = []
         Adapter.COLLECT_SAVES = True
         Adapter.COLLECT_SAVES_FOR_MODEL = self.mdl.__name__
+        cache_writer.begin_burst()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        key_list = list(set(Adapter.block_saved_keys))
-        self.query_dict['key__in'] = key_list
-        indexed_obj_count = self.mdl.objects.filter(**self.query_dict)
-        while Adapter.block_saved_keys and indexed_obj_count.count() < len(key_list):
-            time.sleep(.4)
+        cache_writer.end_burst()
         Adapter.COLLECT_SAVES = False
+        # don't hide the actual exception with a timeout
+        IndexWaiter(self.mdl.objects, Adapter.block_saved_keys,
+                    self.query_dict).wait(raise_on_timeout=exc_type is None)
 
 
 class BlockDelete(object):
@@ -78,12 +208,13 @@ class BlockDelete(object):
         Adapter.block_saved_keys = []
         Adapter.COLLECT_SAVES = True
         Adapter.COLLECT_SAVES_FOR_MODEL = self.mdl.__name__
+        cache_writer.begin_burst()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        indexed_obj_count = self.mdl.objects.filter(key__in=Adapter.block_saved_keys)
-        while Adapter.block_saved_keys and indexed_obj_count.count():
-            time.sleep(.4)
+        cache_writer.end_burst()
         Adapter.COLLECT_SAVES = False
+        IndexWaiter(self.mdl.objects, Adapter.block_saved_keys,
+                    deleted=True).wait(raise_on_timeout=exc_type is None)
 
 
 # noinspection PyTypeChecker
@@ -114,7 +245,7 @@ class Adapter(BaseAdapter):
         self.want_deleted = False
         # default joiner for filter arguments
         self._QUERY_GLUE = ' AND '
-        self._solr_query = []  # query parts, will be compiled before execution
+        self._solr_query = ()  # query parts, will be compiled before execution
         self._solr_params = {
             'sort': 'timestamp desc'}  # search parameters. eg: rows, fl, start, sort etc.
         self._solr_locked = False
@@ -122,6 +253,8 @@ class Adapter(BaseAdapter):
         # self.key = None
         self._riak_cache = []  # caching riak result,
         # for repeating iterations on same query
+        # vclocks of fetched objects by key, till they're passed to model instances
+        self._vclocks = {}
 
     # ######## Development Methods  #########
 
@@ -160,43 +293,315 @@ class Adapter(BaseAdapter):
 
     def __iter__(self):
         self._exec_query()
+        keys = [doc['_yz_rk'] for doc in self._solr_cache['docs']]
+        for data, key in self._get_many(keys):
+            yield data, key
+
+    def iterator(self, chunk_size):
+        """
+        Streams all matching objects in chunks, ordered by key.
+
+        Pages are selected with a range on ``_yz_rk`` after the last key
+        of the previous page, instead of a start offset. So every page costs
+        the same to Solr and writes made while iterating don't shift the
+        following pages. Start, rows and sort params of the query are ignored.
+
+        Args:
+            chunk_size (int): Number of objects to fetch per query.
+
+        Yields:
+            (data, key) tuples.
+        """
+        if not self.compiled_query:
+            self._compile_query()
+        base_query = self.compiled_query
+        params = dict(self._solr_params, rows=chunk_size, sort='_yz_rk asc')
+        params.pop('start', None)
+        last_key = None
+        while True:
+            page = self._clone()
+            page._solr_params = params
+            page._vclocks = self._vclocks
+            if last_key is None:
+                page.compiled_query = base_query
+            else:
+                page.compiled_query = '(%s) AND _yz_rk:{%s TO *]' % (
+                    base_query, self._escape_query(last_key))
+            page._exec_query()
+            keys = [doc['_yz_rk'] for doc in page._solr_cache['docs']]
+            for data, key in page._get_many(keys):
+                yield data, key
+            if len(keys) < chunk_size:
+                return
+            last_key = keys[-1]
+
+    def _get_many(self, keys):
+        """
+        Yields data of given keys, in the same order.
+
+        If caching is enabled, keys are looked up in Redis with one MGET,
+        only the missing ones are fetched from Riak, then written back
+        to the cache in one pipeline.
+
+        Args:
+            keys (list): Riak keys.
+
+        Yields:
+            (data, key) tuples.
+
+        Raises:
+            ObjectDoesNotExist: If a key cannot be found in Riak.
+        """
+        if not settings.ENABLE_CACHING:
+            for obj in self._fetch_many(keys):
+                yield self._get_obj_data(obj), obj.key
+            return
+        cached = self.get_many_from_cache(keys)
+        missing_keys = [key for key, data in zip(keys, cached) if not data]
+        fetched = {}
+        for obj in self._fetch_many(missing_keys):
+            fetched[obj.key] = self._get_obj_data(obj)
+        if fetched:
+            self.set_many_to_cache(fetched)
+        for key, data in zip(keys, cached):
+            if data:
+                if not isinstance(data, six.text_type):
+                    data = data.decode()
+                yield json.loads(data), key
+            else:
+                yield fetched[key], key
+
+    def scan(self, chunk_size, concurrency, checkpoint=None, on_checkpoint=None):
+        """
+        Reads all objects of the bucket from Riak, without querying Solr.
+
+        Keys are listed in pages of ``chunk_size`` from the ``$key`` index,
+        in key order. Objects of up to ``concurrency`` pages are fetched in
+        parallel. Next pages are not listed till the consumer catches up,
+        so memory usage is bounded.
+
+        If the backend of the bucket doesn't support secondary indexes
+        (eg: bitcask), keys are streamed with list keys instead. Streamed
+        keys are not ordered and have no continuations, so such scans
+        can't be resumed from a checkpoint.
+
+        Args:
+            chunk_size (int): Number of keys per page.
+            concurrency (int): Max number of pages to fetch in parallel.
+            checkpoint (str): Continuation token to resume a previous scan from.
+            on_checkpoint (callable): Called with the continuation token after
+                all objects of a page are yielded. None after the last page.
+                Only called at the end when keys are streamed.
+
+        Yields:
+            (data, key) tuples. Keys that no longer exist are skipped.
+        """
+        for obj in self.scan_objects(chunk_size, concurrency, checkpoint, on_checkpoint):
+            yield self._get_obj_data(obj), obj.key
+
+    def scan_objects(self, chunk_size, concurrency, checkpoint=None, on_checkpoint=None):
+        """
+        Works like scan(), but yields riak.RiakObject instances.
+        Encoded data of the objects are kept as is till their data is accessed.
+        """
+        pool = ThreadPool(concurrency)
+        pending = deque()
+        pages = self._list_key_pages(chunk_size, checkpoint)
+        listed_all = False
+        try:
+            while True:
+                while not listed_all and len(pending) < concurrency:
+                    try:
+                        keys, continuation = next(pages)
+                    except StopIteration:
+                        listed_all = True
+                        break
+                    pending.append((pool.apply_async(self._scan_page, (keys,)), continuation))
+                if not pending:
+                    break
+                result, page_checkpoint = pending.popleft()
+                for obj in result.get():
+                    yield obj
+                if on_checkpoint and page_checkpoint is not None:
+                    on_checkpoint(page_checkpoint)
+            if on_checkpoint:
+                on_checkpoint(None)
+        finally:
+            pages.close()
+            pool.terminate()
+            pool.join()
+
+    def _list_key_pages(self, chunk_size, continuation=None):
+        """
+        Yields:
+            (keys, continuation) tuples of the pages of the ``$key`` index.
+            Continuation is None for the last page and for streamed keys.
+        """
+        while True:
+            try:
+                page = self.bucket.get_index('$key', SCAN_START_KEY, SCAN_END_KEY,
+                                             max_results=chunk_size,
+                                             continuation=continuation)
+            except riak.RiakError as e:
+                if 'indexes_not_supported' not in str(e):
+                    raise
+                for keys in self._stream_key_pages(chunk_size):
+                    yield keys, None
+                return
+            continuation = page.continuation if page.has_next_page() else None
+            yield list(page), continuation
+            if continuation is None:
+                return
+
+    def _stream_key_pages(self, chunk_size):
+        keys = []
+        with closing(self.bucket.stream_keys()) as stream:
+            for streamed_keys in stream:
+                keys.extend(streamed_keys)
+                while len(keys) >= chunk_size:
+                    yield keys[:chunk_size]
+                    keys = keys[chunk_size:]
+        if keys:
+            yield keys
+
+    def _scan_page(self, keys):
+        return [obj for obj in self._fetch_many(keys) if obj.exists]
+
+    def _get_obj_data(self, obj):
+        if not obj.exists:
+            raise ObjectDoesNotExist("Cannot find %s in the Riak bucket of %s" % (
+                obj.key, self._model_class))
+        self._vclocks[obj.key] = obj.vclock
+        return obj.data
+
+    def _fetch_many(self, keys):
+        """
+        Fetches given keys from Riak in chunks of ``settings.MULTIGET_CHUNK_SIZE``.
+        Gets of each chunk are fanned out to a long-lived thread pool of
+        ``settings.RIAK_FETCH_CONCURRENCY`` threads, instead of making one
+        serial request per key.
+
+        Args:
+            keys (list): Riak keys, in the order they should be yielded.
+
+        Yields:
+            riak.RiakObject instances, in the same order with given keys.
+        """
+        chunk_size = settings.MULTIGET_CHUNK_SIZE
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            t1 = time.time()
+            if len(chunk) == 1:
+                fetched = [self.bucket.get(chunk[0])]
+            else:
+                fetched = fetch_pool.map(self.bucket.get, chunk)
+            instrumentation.emit(ins.RIAK_GET, self._model_class.__name__,
+                                 time.time() - t1, len(chunk), keys=chunk)
+            for obj in fetched:
+                yield obj
+
+    def _get_stored_fields(self):
+        """
+        Names of the fields that stored in Solr index of the model.
+        Collected from the same definitions SchemaUpdater uses
+        to create the schema.
+
+        Returns:
+            Set of Solr field names.
+        """
+        name = self._model_class.__name__
+        if name not in STORED_FIELDS:
+            STORED_FIELDS[name] = set(
+                field_name for field_name, solr_type, index, store, multi
+                in self._model_class()._collect_index_fields() if store)
+        return STORED_FIELDS[name]
+
+    def iter_projection(self, fields):
+        """
+        Yields values of given fields for each matching object.
+        Values read from stored fields of Solr documents, Riak
+        is not touched at all. Values are converted to the formats
+        they're stored in Riak, but Solr keeps dates with
+        millisecond precision.
+
+        Args:
+            fields (list): Field names. "key" stands for the object key,
+                double underscores can be used to reach fields of nodes.
+                eg: auth_info__email
+
+        Yields:
+            List of field values, in the same order with given fields.
+
+        Raises:
+            NotCompatible: If any of given fields is not stored in Solr.
+        """
+        solr_fields = ['_yz_rk' if f == 'key' else f.replace('__', '.') for f in fields]
+        stored_fields = self._get_stored_fields()
+        not_stored = [f for f in solr_fields if f != '_yz_rk' and f not in stored_fields]
+        if not_stored:
+            raise NotCompatible("%s field(s) of %s are not stored in Solr" % (
+                ', '.join(not_stored), self._model_class.__name__))
+        self.set_params(fl=','.join(set(solr_fields + ['_yz_rk'])))
+        self._exec_query()
+        field_instances = [self._get_field(f) for f in fields]
         for doc in self._solr_cache['docs']:
-            # if settings.DEBUG:
-            #     t1 = time.time()
-            obj = self.bucket.get(doc['_yz_rk'])
-            if not obj.exists:
-                raise ObjectDoesNotExist("We got %s from Solr for %s bucket but cannot find it in the Riak" % (
-                    doc['_yz_rk'], self._model_class))
-            yield obj.data, obj.key
-            if settings.DEBUG:
-                sys.PYOKO_STAT_COUNTER['read'] += 1
-                sys.PYOKO_LOGS[self._model_class.__name__].append(doc['_yz_rk'])
-                # sys._debug_db_queries.append({
-                #     'TIMESTAMP': t1,
-                #     'KEY': doc['_yz_rk'],
-                #     'BUCKET': self.index_name,
-                #     'TIME': round(time.time() - t1, 5)})
+            yield [self._from_solr(field, doc.get(f))
+                   for field, f in zip(field_instances, solr_fields)]
+
+    def _get_field(self, path):
+        """
+        Args:
+            path (str): Double underscored path of a field. eg: auth_info__email
+
+        Returns:
+            Field instance, None for keys and links.
+        """
+        node_class = self._model_class
+        names = path.split('__')
+        for name in names[:-1]:
+            node_class = next((klass for _, klass, data_name in node_class._get_layout().nodes
+                               if data_name == name), None)
+            if node_class is None:
+                return None
+        return next((_field for _, _field, data_name in node_class._get_layout().fields
+                     if data_name == names[-1]), None)
+
+    @staticmethod
+    def _from_solr(field, value):
+        if field is None:
+            return value
+        # fields of list nodes are multi-valued
+        if isinstance(value, list):
+            return [field.from_solr(val) for val in value]
+        return field.from_solr(value)
+
+    def _clone(self):
+        """
+        Creates a copy of the adapter with the same query state.
+
+        Bypasses __init__, so Riak client and bucket are shared instead of
+        resolved again. Query parts and Solr params are never mutated in place
+        (see add_query and set_params), so they're shared with the clone too.
+        Caches are not populated.
+
+        Returns:
+            Adapter instance.
+        """
+        obj = self.__class__.__new__(self.__class__)
+        obj.__dict__.update(self.__dict__)
+        obj._riak_cache = []
+        obj._solr_cache = {}
+        obj._vclocks = {}
+        obj.compiled_query = self._pre_compiled_query or ''
+        obj._solr_locked = False
+        return obj
 
     def __deepcopy__(self, memo=None):
         """
         A deep copy method that doesn't populate caches
         and shares Riak client and bucket
         """
-        obj = self.__class__(**self._cfg)
-        for k, v in self.__dict__.items():
-            if k.endswith(('_current_context', 'bucket', '_client', 'model_class', '_cfg')):
-                obj.__dict__[k] = v
-            elif k == '_riak_cache':
-                obj.__dict__[k] = []
-            elif k == '_solr_cache':
-                obj.__dict__[k] = {}
-            elif k == '_solr_query':
-                obj.__dict__[k] = v[:]
-            else:
-                obj.__dict__[k] = copy.deepcopy(v, memo)
-        obj.compiled_query = obj._pre_compiled_query or ''
-        obj._solr_locked = False
-        return obj
+        return self._clone()
 
     def _set_bucket(self, type, name):
         """
@@ -209,8 +614,11 @@ class Adapter(BaseAdapter):
             self._cfg['bucket_type'] = type
         if name:
             self._cfg['bucket_name'] = name
-        self.bucket = self._client.bucket_type(self._cfg['bucket_type']
-                                               ).bucket(self._cfg['bucket_name'])
+        riak_client = self._client
+        bucket_type, bucket_name = self._cfg['bucket_type'], self._cfg['bucket_name']
+        # resolved per process, as riak client is re-created in forked processes
+        self.bucket = ProcessLocal(
+            lambda: riak_client.bucket_type(bucket_type).bucket(bucket_name))
         self.index_name = "%s_%s" % (self._cfg['bucket_type'], self._cfg['bucket_name'])
         return self
 
@@ -238,7 +646,10 @@ class Adapter(BaseAdapter):
         obj.add_index('key_bin', model.key)
         obj.add_index('model_bin', vdata['model'])
         obj.add_index('timestamp_int', int(vdata['timestamp']))
+        t1 = time.time()
         obj.store()
+        instrumentation.emit(ins.RIAK_STORE, self._model_class.__name__, time.time() - t1, 1,
+                             kind='version', key=obj.key, new=True)
         return obj.key
 
     def _write_log(self, version_key, meta_data, index_fields):
@@ -262,9 +673,12 @@ class Adapter(BaseAdapter):
         obj = log_bucket.new(data=meta_data)
         obj.add_index('version_key_bin', version_key)
         obj.add_index('timestamp_int', int(meta_data['timestamp']))
-        for field, index_type in index_fields:
+        for field, index_type in index_fields or []:
             obj.add_index('%s_%s' % (field, index_type), meta_data.get(field, ""))
+        t1 = time.time()
         obj.store()
+        instrumentation.emit(ins.RIAK_STORE, self._model_class.__name__, time.time() - t1, 1,
+                             kind='log', key=obj.key, new=True)
 
     # def save(self, data, key=None, meta_data=None):
     #     if key is not None:
@@ -292,25 +706,111 @@ class Adapter(BaseAdapter):
                 [('lorem','bin'),('dolar','int')]
         :return:
         """
-        # if model:
-        #     self._model = model
-        if settings.DEBUG:
-            t1 = time.time()
+        clean_value = self._serialize(model)
+        if clean_value is not None:
+            self._store_model(model, clean_value, meta_data, index_fields)
+        return model
+
+    def _serialize(self, model):
+        """
+        Serializes the model and marks it as clean.
+
+        Returns:
+            Serialized model data, which is also set as the model's _data.
+            None if the object exists and its data is not changed since it's
+            loaded or last saved, so it doesn't need to be stored.
+            See ``settings.SKIP_UNCHANGED_SAVES``.
+        """
+        t1 = time.time()
         clean_value = model.clean_value()
-        model._data = clean_value
+        unchanged = settings.SKIP_UNCHANGED_SAVES and self._is_unchanged(model, clean_value)
+        # snapshot is kept as is, so its timestamps reflect the stored data
+        model._set_clean(model._data if unchanged else clean_value)
+        model.setattr('_data_is_stored', unchanged)
+        instrumentation.emit(ins.SERIALIZE, model.__class__.__name__, time.time() - t1, 1,
+                             key=model.key, unchanged=unchanged)
+        return None if unchanged else clean_value
+
+    @staticmethod
+    def _is_unchanged(model, clean_value):
+        """
+        Compares serialized data of the model with the data it's loaded
+        with or last saved, ignoring TimeStamp fields.
+
+        Args:
+            model (instance): Model instance.
+            clean_value (dict): Serialized model data.
+
+        Returns:
+            True if the object exists and its data is the same with the stored one.
+        """
+        stored = model._data
+        if not (model._data_is_stored and model.exist) or len(stored) != len(clean_value):
+            return False
+        timestamp_fields = model._get_layout().timestamp_fields
+        return all(key in timestamp_fields or (key in stored and stored[key] == value)
+                   for key, value in clean_value.items())
+
+    def save_models(self, models, meta_data=None, index_fields=None):
+        """
+        Saves given model instances. Serialization is done one by one,
+        then objects, version and log records are stored in parallel
+        by at most ``settings.BULK_SAVE_CONCURRENCY`` threads.
 
-        if settings.DEBUG:
-            t2 = time.time()
+        Args:
+            models (list): Model instances.
+            meta_data (dict): JSON serializable meta data for logging of save operations.
+            index_fields (list): Tuple list for indexing keys in riak (with 'bin' or 'int').
+
+        Returns:
+            List of saved model instances.
+        """
+        jobs = []
+        for model in models:
+            clean_value = self._serialize(model)
+            if clean_value is None:
+                continue
+            # _write_log updates the meta data dict, each object should have its own copy
+            meta = meta_data or model.save_meta_data
+            jobs.append((model, clean_value, meta.copy() if meta else None, index_fields))
+        pool = ThreadPool(min(settings.BULK_SAVE_CONCURRENCY, len(jobs)) or 1)
+        try:
+            with cache_writer.burst():
+                pool.map(lambda job: self._store_model(*job), jobs)
+        finally:
+            pool.close()
+            pool.join()
+        return models
+
+    def _store_model(self, model, clean_value, meta_data=None, index_fields=None):
+        """
+        Stores serialized model data with its version and log records.
 
+        Args:
+            model (instance): Model instance.
+            clean_value (dict): Serialized model data.
+            meta_data (dict): JSON serializable meta data for logging of save operation.
+            index_fields (list): Tuple list for indexing keys in riak (with 'bin' or 'int').
+        """
+        t1 = time.time()
         if not model.exist:
             obj = self.bucket.new(data=clean_value).store()
             model.key = obj.key
             new_obj = True
         else:
             new_obj = False
-            obj = self.bucket.get(model.key)
-            obj.data = clean_value
+            if model._vclock:
+                # stored with the causal context the object is loaded with,
+                # instead of fetching it again just to get its vclock
+                obj = self.bucket.new(model.key, data=clean_value)
+                obj.vclock = model._vclock
+            else:
+                obj = self.bucket.get(model.key)
+                obj.data = clean_value
             obj.store()
+        model.setattrs(_vclock=obj.vclock, _data_is_stored=True)
+        instrumentation.emit(ins.RIAK_STORE, self._model_class.__name__, time.time() - t1, 1,
+                             kind='object', key=obj.key, new=new_obj)
 
         if settings.ENABLE_VERSIONS:
             version_key = self._write_version(clean_value, model)
@@ -326,65 +826,69 @@ class Adapter(BaseAdapter):
 
         if self.COLLECT_SAVES and self.COLLECT_SAVES_FOR_MODEL == model.__class__.__name__:
             self.block_saved_keys.append(obj.key)
-        if settings.DEBUG:
-            if new_obj:
-                sys.PYOKO_STAT_COUNTER['save'] += 1
-                sys.PYOKO_LOGS['new'].append(obj.key)
-            else:
-                sys.PYOKO_LOGS[self._model_class.__name__].append(obj.key)
-                sys.PYOKO_STAT_COUNTER['update'] += 1
-        # sys._debug_db_queries.append({
-        #         'TIMESTAMP': t1,
-        #         'KEY': obj.key,
-        #         'BUCKET': self.index_name,
-        #         'SAVE_IS_NEW': new_obj,
-        #         'SERIALIZATION_TIME': round(t2 - t1, 5),
-        #         'TIME': round(time.time() - t2, 5)
-        #     })
-        return model
 
     @staticmethod
     def set_to_cache(key, value):
-        try:
-            if not value['deleted']:
-                cache.set(key, json.dumps(value), settings.CACHE_EXPIRE_DURATION)
-            else:
-                cache.delete(key)
-        except Exception as e:
-            # todo should add log.error()
-            pass
+        cache_writer.set(key, value)
+
+    @staticmethod
+    def set_many_to_cache(values):
+        """
+        Writes given objects to the cache in one pipeline.
+
+        Args:
+            values (dict): Object data by key.
+        """
+        cache_writer.set_many(values)
 
     @staticmethod
     def get_from_cache(key):
+        return Adapter.get_many_from_cache([key])[0] or ""
+
+    @staticmethod
+    def get_many_from_cache(keys):
+        """
+        Reads given keys from the cache with one MGET.
+        Values that are not yet flushed by the cache writer take precedence.
+
+        Args:
+            keys (list): Object keys.
+
+        Returns:
+            List of cached values, None for the keys that are not in the cache.
+        """
+        if not keys:
+            return []
+        t1 = time.time()
         try:
-            return cache.get(key)
-        except Exception as e:
-            # todo should add log.error()
-            return ""
+            values = cache.mget(keys)
+        except Exception:
+            cache_stats.incr('error')
+            log.exception("Cache read failed for %s key(s)" % len(keys))
+            values = [None] * len(keys)
+        duration = time.time() - t1
+        cache_stats.incr('read')
+        cache_stats.add_latency('read', duration)
+        for i, key in enumerate(keys):
+            is_pending, value = cache_writer.get_pending(key)
+            if is_pending:
+                values[i] = value
+        hits = [key for key, value in zip(keys, values) if value]
+        misses = [key for key, value in zip(keys, values) if not value]
+        cache_stats.incr('hit', len(hits))
+        cache_stats.incr('miss', len(misses))
+        if hits:
+            instrumentation.emit(ins.CACHE_HIT, None, duration, len(hits), keys=hits)
+        if misses:
+            instrumentation.emit(ins.CACHE_MISS, None, duration, len(misses), keys=misses)
+        return values
 
     def get(self, key=None):
         if key:
             if settings.ENABLE_CACHING:
-                data = self.get_from_cache(key)
-                if data:
-                    if six.PY2:
-                        _data = data
-                    if six.PY3:
-                        _data = data.decode()
-                    data = json.loads(_data)
-                    return data, str(key)
-                else:
-                    self._riak_cache = [self.bucket.get(key)]
-                    # In order to set to the cache
-                    _data, _key = self.get_one()
-                    try:
-                        self.set_to_cache(_key, _data)
-                    except Exception as e:
-                        # todo should add log.error()
-                        pass
-                    return _data, _key
+                return next(self._get_many([str(key)]))
             else:
-                self._riak_cache = [self.bucket.get(key)]
+                self._riak_cache = list(self._fetch_many([str(key)]))
 
         return self.get_one()
 
@@ -404,16 +908,17 @@ class Adapter(BaseAdapter):
                     "%s objects returned for %s" % (self.count(),
                                                     self._model_class.__name__))
 
-            self._riak_cache = [self.bucket.get(self._solr_cache['docs'][0]['_yz_rk'])]
+            key = self._solr_cache['docs'][0]['_yz_rk']
+            if settings.ENABLE_CACHING:
+                return next(self._get_many([key]))
 
-            sys.PYOKO_LOGS[self._model_class.__name__].append(
-                self._solr_cache['docs'][0]['_yz_rk'])
+            self._riak_cache = list(self._fetch_many([key]))
 
         if not self._riak_cache[0].exists:
             raise ObjectDoesNotExist("%s %s" % (self.index_name,
                                                 self._riak_cache[0].key))
 
-        return self._riak_cache[0].data, self._riak_cache[0].key
+        return self._get_obj_data(self._riak_cache[0]), self._riak_cache[0].key
 
     def count(self):
         """Counts the number of results that could be accessed with the current parameters.
@@ -481,8 +986,8 @@ class Adapter(BaseAdapter):
             raise Exception("Query already executed, no changes can be made."
                             "%s %s" % (self._solr_query, self._solr_params)
                             )
-        self._solr_params['sort'] = ', '.join(['%s desc' % arg[1:] if arg.startswith('-')
-                                               else '%s asc' % arg for arg in args])
+        self.set_params(sort=', '.join(['%s desc' % arg[1:] if arg.startswith('-')
+                                        else '%s asc' % arg for arg in args]))
 
     def set_params(self, **params):
         """
@@ -492,10 +997,14 @@ class Adapter(BaseAdapter):
             raise Exception("Query already executed, no changes can be made."
                             "%s %s" % (self._solr_query, self._solr_params)
                             )
-        self._solr_params.update(params)
+        # params dict is shared between clones, so we don't update it in place
+        solr_params = self._solr_params.copy()
+        solr_params.update(params)
+        self._solr_params = solr_params
 
     def add_query(self, filters):
-        self._solr_query.extend([f if len(f) == 3 else (f[0], f[1], False) for f in filters])
+        # query parts are shared between clones, so we don't extend them in place
+        self._solr_query += tuple(f if len(f) == 3 else (f[0], f[1], False) for f in filters)
 
     def _escape_query(self, query, escaped=False):
         """
@@ -510,10 +1019,11 @@ class Adapter(BaseAdapter):
         """
         if escaped:
             return query
-        query = six.text_type(query)
-        for e in ['+', '-', '&&', '||', '!', '(', ')', '{', '}', '[', ']', '^', '"', '~', '*',
-                  '?', ':', ' ']:
-            query = query.replace(e, "\\%s" % e)
+        query = six.text_type(query).translate(ESCAPE_TABLE)
+        if '&&' in query:
+            query = query.replace('&&', '\\&&')
+        if '||' in query:
+            query = query.replace('||', '\\||')
         return query
 
     def _parse_query_modifier(self, modifier, qval, is_escaped):
@@ -656,62 +1166,139 @@ class Adapter(BaseAdapter):
             return key, val, True
         return key, val, escaped
 
+    def _plan_value(self, key, kind, is_escaped):
+        """
+        Query plan counterpart of _process_query_val.
+
+        Returns:
+            (key, convert, is_escaped) tuple. convert(adapter, val) returns
+            the processed value, None if value stays as is.
+        """
+        if kind == 'date':
+            raw_key = key
+            return key, lambda adapter, val: adapter._handle_date(val, raw_key), True
+        if kind in ('model', 'empty_model'):
+            key += '_id'
+            if kind == 'model':
+                return key, lambda adapter, val: val.key, True
+        if kind in ('empty', 'empty_model'):
+            key = ('-%s' % key).replace('--', '')
+            return key, lambda adapter, val: '[* TO *]', True
+        return key, None, is_escaped
+
+    def _plan_term(self, key, convert, is_escaped):
+        """
+        Query plan counterpart of _parse_query_key.
+
+        Returns:
+            (key, render) tuple. render(adapter, val) returns the query value.
+        """
+        for suffix, modifier in QUERY_MODIFIERS:
+            if key.endswith(suffix):
+                key = key[:-len(suffix)]
+                if convert:
+                    return key, lambda adapter, val: adapter._parse_query_modifier(
+                        modifier, convert(adapter, val), is_escaped)
+                return key, lambda adapter, val: adapter._parse_query_modifier(
+                    modifier, val, is_escaped)
+        if key != 'NOKEY' and not is_escaped:
+            # values are converted only for already escaped ones
+            return key, lambda adapter, val: adapter._escape_query(val)
+        return key, convert or (lambda adapter, val: val)
+
+    def _plan_query_part(self, key, kind, is_escaped):
+        """
+        Prepares compilation of a query part of given shape.
+
+        Args:
+            key (str): Query key.
+            kind: Kind of the query value, see _value_kind()
+            is_escaped (bool): Query value is already escaped.
+
+        Returns:
+            (render, is_deleted) tuple. render(adapter, val) returns the compiled
+            query part for given value. is_deleted is True for queries on
+            the deleted field.
+        """
+        if key == 'key':
+            key = '_yz_rk'
+        elif key == '-key':
+            key = '-_yz_rk'
+        elif key[:5] == 'key__':  # to handle key__in etc.
+            key = '_yz_rk__' + key[5:]
+        elif key[:6] == '-key__':  # to handle key__in etc.
+            key = '-_yz_rk__' + key[6:]
+
+        key, convert, is_escaped = self._plan_value(key, kind, is_escaped)
+        convert = convert or (lambda adapter, val: val)
+        # OR_QRY parts are joined with "OR" after escaping & parsing
+        if key == 'OR_QRY' and isinstance(kind, tuple):
+            terms = [self._plan_term(*self._plan_value(k, k_kind, is_escaped))
+                     for k, k_kind in kind]
+
+            def render(adapter, val):
+                return "(%s)" % ' OR '.join(
+                    '%s:%s' % (term_key, term(adapter, v))
+                    for (term_key, term), v in zip(terms, val.values()))
+
+            return render, False
+        # __in query is same as OR_QRY but key stays same for all values
+        if key.endswith('__in'):
+            key = key[:-4]
+            prefix = '*:* ' if key.startswith('-') else ''
+
+            def render(adapter, val):
+                return "(%s%s)" % (prefix, ' OR '.join(
+                    '%s:%s' % (key, adapter._escape_query(v, is_escaped))
+                    for v in convert(adapter, val)))
+
+            return render, False
+        key, term = self._plan_term(key, convert, is_escaped)
+        # as long as not explicitly asked for,
+        # we filter out records with deleted flag
+        is_deleted = key == 'deleted'
+        # convert two underscores to dot notation
+        key = key.replace('__', '.')
+        # NOKEY means we already combined key partition in to "val"
+        if key == 'NOKEY':
+            return lambda adapter, val: "(%s)" % term(adapter, val), is_deleted
+        return lambda adapter, val: "%s:%s" % (key, term(adapter, val)), is_deleted
+
+    def _get_query_plan(self):
+        """
+        Returns cached query plan for the shape of the current query.
+        Shape consists of keys, kinds of values and escape flags of query parts.
+
+        Returns:
+            (renderers, want_deleted) tuple.
+        """
+        shape = (self.__class__,) + tuple((key, _value_kind(val), is_escaped)
+                                          for key, val, is_escaped in self._solr_query)
+        plan = QUERY_PLANS.get(shape)
+        if plan is None:
+            parts = [self._plan_query_part(*part) for part in shape[1:]]
+            plan = (tuple(render for render, _ in parts),
+                    any(is_deleted for _, is_deleted in parts))
+            if len(QUERY_PLANS) >= settings.QUERY_PLAN_CACHE_SIZE:
+                QUERY_PLANS.clear()
+            QUERY_PLANS[shape] = plan
+        return plan
+
     def _compile_query(self):
         """
         Builds SOLR query and stores it into self.compiled_query
+
+        Query parts are rendered with the cached plan of the query shape,
+        so only the values are processed on repeated queries.
         """
         # https://wiki.apache.org/solr/SolrQuerySyntax
         # http://lucene.apache.org/core/2_9_4/queryparsersyntax.html
-        query = []
-
-        # filtered_query = self._model_class.row_level_access(self._current_context, self)
-        # if filtered_query is not None:
-        #     self._solr_query += filtered_query._solr_query
-        # print(self._solr_query)
-        for key, val, is_escaped in self._solr_query:
-            # querying on a linked model by model instance
-            # it should be a Model, not a Node!
-            if key == 'key':
-                key = '_yz_rk'
-            elif key == '-key':
-                    key = '-_yz_rk'
-            elif key[:5] == 'key__':  # to handle key__in etc.
-                key = '_yz_rk__' + key[5:]
-            elif key[:6] == '-key__':  # to handle key__in etc.
-                key = '-_yz_rk__' + key[6:]
-
-            key, val, is_escaped = self._process_query_val(key, val, is_escaped)
-            # if it's not one of the expected objects, it should be a string
-            # if key == "OR_QRY" then join them with "OR" after escaping & parsing
-            if key == 'OR_QRY':
-                key = 'NOKEY'
-                val = ' OR '.join(
-                    ['%s:%s' % self._parse_query_key(*self._process_query_val(k, v, is_escaped)) for
-                     k, v in val.items()])
-                is_escaped = True
-            # __in query is same as OR_QRY but key stays same for all values
-            elif key.endswith('__in'):
-                key = key[:-4]
-                val = ' OR '.join(
-                    ['%s:%s' % (key, self._escape_query(v, is_escaped)) for v in val])
-                if key.startswith('-'):
-                    val = '*:* %s' % val
-                key = 'NOKEY'
-                is_escaped = True
-            # parse the query
-            key, val = self._parse_query_key(key, val, is_escaped)
-
-            # as long as not explicitly asked for,
-            # we filter out records with deleted flag
-            if key == 'deleted':
-                self.want_deleted = True
-            # convert two underscores to dot notation
-            key = key.replace('__', '.')
-            # NOKEY means we already combined key partition in to "val"
-            if key == 'NOKEY':
-                query.append("(%s)" % val)
-            else:
-                query.append("%s:%s" % (key, val))
+        t1 = time.time()
+        renderers, want_deleted = self._get_query_plan()
+        if want_deleted:
+            self.want_deleted = True
+        query = [render(self, val) for render, (key, val, is_escaped) in
+                 zip(renderers, self._solr_query)]
 
         # need to add *:* for negative queries, if
         # query has only one criteria, such as:
@@ -737,6 +1324,8 @@ class Adapter(BaseAdapter):
         elif not joined_query:
             joined_query = '*:*'
         self.compiled_query = joined_query
+        instrumentation.emit(ins.QUERY_COMPILED, self._model_class.__name__, time.time() - t1,
+                             len(joined_query), query=joined_query)
 
     def _process_params(self):
         """
@@ -746,12 +1335,14 @@ class Adapter(BaseAdapter):
         Returns:
             Processed self._solr_params dict.
         """
-        if 'rows' not in self._solr_params:
-            self._solr_params['rows'] = self._cfg['row_size']
-        for key, val in self._solr_params.items():
+        solr_params = self._solr_params.copy()
+        if 'rows' not in solr_params:
+            solr_params['rows'] = self._cfg['row_size']
+        for key, val in solr_params.items():
             if isinstance(val, str):
-                self._solr_params[key] = val.encode(encoding='UTF-8')
-        return self._solr_params
+                solr_params[key] = val.encode(encoding='UTF-8')
+        self._solr_params = solr_params
+        return solr_params
 
     def _get_debug_data(self):
         return ("                      ~=QUERY DEBUG=~                              "
@@ -775,25 +1366,18 @@ class Adapter(BaseAdapter):
                 self._compile_query()
             try:
                 solr_params = self._process_params()
-                if settings.DEBUG:
-                    t1 = time.time()
+                t1 = time.time()
                 self._solr_cache = self.bucket.search(self.compiled_query,
                                                       self.index_name,
                                                       **solr_params)
+                instrumentation.emit(ins.SOLR_EXECUTED, self._model_class.__name__,
+                                     time.time() - t1, len(self._solr_cache['docs']),
+                                     query=self.compiled_query, params=solr_params,
+                                     num_found=self._solr_cache.get('num_found'))
                 # if DEBUG is on and DEBUG_LEVEL set to a value higher than 5
                 # print query in to console.
                 if settings.DEBUG and settings.DEBUG_LEVEL >= 5:
                     print("QRY => %s\nSOLR_PARAMS => %s" % (self.compiled_query, solr_params))
-
-
-                    # if settings.DEBUG:
-                    #     sys.PYOKO_STAT_COUNTER['search'] += 1
-                    #     sys._debug_db_queries.append({
-                    #         'TIMESTAMP': t1,
-                    #         'QUERY': self.compiled_query,
-                    #         'BUCKET': self.index_name,
-                    #         'QUERY_PARAMS': solr_params,
-                    #         'TIME': round(time.time() - t1, 4)})
             except riak.RiakError as err:
                 err.value += self._get_debug_data()
                 raise
@@ -0,0 +1,89 @@
+# -*-  coding: utf-8 -*-
+"""
+asyncio interface for the Riak adapter.
+
+Riak client is blocking, so DB calls are run on a thread pool executor
+while the event loop keeps serving other tasks. Query building and
+compilation are still done by the wrapped db_riak.Adapter.
+
+Requires Python 3.7+
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from pyoko.conf import settings
+
+_executor = None
+
+
+def get_executor():
+    """
+    Returns:
+        Shared executor for DB calls, with ``settings.ASYNC_DB_THREADS`` workers.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(settings.ASYNC_DB_THREADS)
+    return _executor
+
+
+class AsyncAdapter(object):
+    """
+    Awaitable counterpart of db_riak.Adapter.
+
+    Args:
+        adapter (Adapter): Adapter instance to run the queries of.
+        executor: Executor to run blocking DB calls. Defaults to get_executor().
+    """
+
+    def __init__(self, adapter, executor=None):
+        self.adapter = adapter
+        self.executor = executor or get_executor()
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Runs given blocking function on the executor.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor,
+                                          functools.partial(func, *args, **kwargs))
+
+    async def count(self):
+        return await self.run(self.adapter.count)
+
+    async def get(self, key=None):
+        return await self.run(self.adapter.get, key)
+
+    async def save_model(self, model, meta_data=None, index_fields=None):
+        return await self.run(self.adapter.save_model, model, meta_data, index_fields)
+
+    async def iterate(self):
+        """
+        Executes the query, then fetches the resulting objects.
+        Chunks of ``settings.MULTIGET_CHUNK_SIZE`` keys are fetched concurrently.
+
+        Yields:
+            (data, key) tuples, in the order of Solr results.
+        """
+        await self.run(self.adapter._exec_query)
+        keys = [doc['_yz_rk'] for doc in self.adapter._solr_cache['docs']]
+        chunk_size = settings.MULTIGET_CHUNK_SIZE
+        fetches = [asyncio.ensure_future(self.run(self._fetch, keys[i:i + chunk_size]))
+                   for i in range(0, len(keys), chunk_size)]
+        try:
+            for fetch in fetches:
+                for data, key in await fetch:
+                    yield data, key
+        finally:
+            # iteration may be stopped before all chunks are consumed
+            for fetch in fetches:
+                fetch.cancel()
+
+    def _fetch(self, keys):
+        return list(self.adapter._get_many(keys))
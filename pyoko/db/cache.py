@@ -0,0 +1,252 @@
+# -*-  coding: utf-8 -*-
+"""
+Redis cache writer and cache statistics.
+
+Cache writes of saved objects are collected and flushed to Redis
+through pipelines instead of making one round trip per object.
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from pyoko.conf import settings
+from pyoko.db.connection import cache
+
+log = logging.getLogger(__name__)
+
+
+class CacheStats(object):
+    """
+    Thread safe hit, miss, error and latency counters of the cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = {
+                'hit': 0,
+                'miss': 0,
+                'error': 0,
+                'set': 0,
+                'delete': 0,
+                'read': 0,
+                'flush': 0,
+            }
+            # total seconds spent on reads and pipeline flushes
+            self._latency = {
+                'read': 0.0,
+                'flush': 0.0,
+            }
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def add_latency(self, name, duration):
+        with self._lock:
+            self._latency[name] += duration
+
+    def as_dict(self):
+        """
+        Returns:
+            Dict of counters, with total and average latencies of reads and flushes.
+        """
+        with self._lock:
+            result = self._counters.copy()
+            for name, total in self._latency.items():
+                count = self._counters[name]
+                result['%s_time' % name] = total
+                result['%s_avg_time' % name] = total / count if count else 0.0
+        return result
+
+
+cache_stats = CacheStats()
+
+
+class CacheWriter(object):
+    """
+    Collects cache sets and deletes, then flushes them to Redis in one pipeline.
+
+    Outside of a burst, writes are flushed immediately. In a burst
+    they're buffered till the end of the burst or till ``batch_size``
+    writes are collected. In background mode, a daemon thread does the flushing.
+
+    Args:
+        background (bool): Defaults to ``settings.CACHE_WRITE_BACKGROUND``
+        batch_size (int): Defaults to ``settings.CACHE_WRITE_BATCH_SIZE``
+
+    Writes that are not yet flushed can be read with get_pending(),
+    so readers don't get stale data from the cache.
+
+    .. code-block:: python
+
+        with cache_writer.burst():
+            for data in records:
+                Person(**data).save()
+
+    """
+
+    def __init__(self, background=None, batch_size=None):
+        # unless given, read from settings on use, as settings are loaded lazily
+        self._background = background
+        self._batch_size = batch_size
+        self._lock = threading.Lock()
+        # flushes are serialized, so only one pipeline is in flight and
+        # newer values of a key can't be overwritten by older ones
+        self._flush_lock = threading.Lock()
+        # key => serialized value, None for deletions
+        self._pending = {}
+        self._in_flight = {}
+        # bursts are shared by all threads, so the workers of a bulk save
+        # write to the same buffer
+        self._burst_depth = 0
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def background(self):
+        if self._background is None:
+            return settings.CACHE_WRITE_BACKGROUND
+        return self._background
+
+    @property
+    def batch_size(self):
+        return self._batch_size or settings.CACHE_WRITE_BATCH_SIZE
+
+    def set(self, key, value):
+        """
+        Schedules caching of object data. Deleted objects are removed from the cache.
+
+        Args:
+            key (str): Object key.
+            value (dict): Object data.
+        """
+        self.set_many({key: value})
+
+    def set_many(self, values):
+        """
+        Args:
+            values (dict): Object data by key.
+        """
+        self._add(dict((key, None if value['deleted'] else json.dumps(value))
+                       for key, value in values.items()))
+
+    def delete(self, key):
+        self._add({key: None})
+
+    def get_pending(self, key):
+        """
+        Args:
+            key (str): Object key.
+
+        Returns:
+            (is_pending, value) tuple. Value is None for pending deletions.
+        """
+        with self._lock:
+            for ops in (self._pending, self._in_flight):
+                if key in ops:
+                    return True, ops[key]
+        return False, None
+
+    def _add(self, ops):
+        with self._lock:
+            self._pending.update(ops)
+            pending_count = len(self._pending)
+        if self.background:
+            self._ensure_thread()
+            self._wakeup.set()
+        elif not self._burst_depth or pending_count >= self.batch_size:
+            self.flush()
+
+    def begin_burst(self):
+        with self._lock:
+            self._burst_depth += 1
+
+    def end_burst(self):
+        with self._lock:
+            self._burst_depth -= 1
+            burst_ended = not self._burst_depth
+        if burst_ended and not self.background:
+            self.flush()
+
+    @contextmanager
+    def burst(self):
+        """
+        Buffers the cache writes of the enclosed block.
+        """
+        self.begin_burst()
+        try:
+            yield self
+        finally:
+            self.end_burst()
+
+    def flush(self):
+        """
+        Writes pending sets and deletes to Redis in one pipeline.
+        Errors are logged and counted, not raised.
+        """
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            ops, self._pending = self._pending, {}
+            self._in_flight = ops
+        if not ops:
+            return
+        t1 = time.time()
+        try:
+            pipe = cache.pipeline(transaction=False)
+            for key, value in ops.items():
+                if value is None:
+                    pipe.delete(key)
+                else:
+                    pipe.set(key, value, settings.CACHE_EXPIRE_DURATION)
+            pipe.execute()
+            deleted = sum(1 for value in ops.values() if value is None)
+            cache_stats.incr('delete', deleted)
+            cache_stats.incr('set', len(ops) - deleted)
+        except Exception:
+            cache_stats.incr('error')
+            log.exception("Cache flush failed for %s key(s)" % len(ops))
+        finally:
+            with self._lock:
+                self._in_flight = {}
+            cache_stats.incr('flush')
+            cache_stats.add_latency('flush', time.time() - t1)
+
+    def _ensure_thread(self):
+        # threads don't survive os.fork(), so we also check the pid
+        with self._lock:
+            if self._thread and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='pyoko-cache-writer')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            self.flush()
+
+
+# configured by CACHE_WRITE_BACKGROUND and CACHE_WRITE_BATCH_SIZE settings
+cache_writer = CacheWriter()
+
+# don't lose the buffered writes of the background thread on exit
+atexit.register(cache_writer.flush)
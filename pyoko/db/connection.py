@@ -1,27 +1,215 @@
 # -*-  coding: utf-8 -*-
 """
 riak client configuration
+
+Clients are created on first use in each process, so forked
+processes (eg: daemonized management commands, multi-process
+web servers) don't share sockets with their parent.
 """
 
 # Copyright (C) 2015 ZetaOps Inc.
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
+import atexit
+import itertools
+import os
+import threading
+from multiprocessing.pool import ThreadPool
 
 import riak
+from riak.client.multi import MultiGetPool as RiakMultiGetPool
+from riak.util import lazy_property
 from pyoko.conf import settings
 
-from redis import Redis
+from redis import Redis, ConnectionPool
+
+
+class ProcessLocal(object):
+    """
+    Proxy to an object that is created by given factory on first access
+    in each process.
+
+    Args:
+        factory (callable): Creates the proxied object.
+    """
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_pid', None)
+        object.__setattr__(self, '_obj', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _get_object(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    object.__setattr__(self, '_obj', self._factory())
+                    object.__setattr__(self, '_pid', pid)
+        return self._obj
+
+    def __getattr__(self, name):
+        return getattr(self._get_object(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get_object(), name, value)
+
+    def __repr__(self):
+        return "<ProcessLocal %r>" % self._get_object()
+
+
+class MultiGetPool(RiakMultiGetPool):
+    """
+    Multiget pool of daemon worker threads, which don't block
+    the interpreter from exiting if the pool is never stopped.
+    """
+
+    def start(self):
+        if self._started.is_set():
+            return
+        with self._lock:
+            if not self._started.is_set():
+                for i in range(self._size):
+                    worker = threading.Thread(target=self._worker_method,
+                                              name="pyoko.multiget-worker-%s" % i)
+                    worker.daemon = True
+                    worker.start()
+                    self._workers.append(worker)
+                self._started.set()
+
+
+class RiakClient(riak.RiakClient):
+    """
+    Sends requests to healthy nodes in round robin order.
+
+    Riak client keeps a decaying error rate per node, nodes that have an
+    error rate above ``settings.RIAK_NODE_ERROR_RATE`` are skipped.
+    If none of the nodes are healthy, the one with the lowest error rate is used.
+
+    Each connection pool of the client opens at most ``settings.RIAK_MAX_CONNECTIONS``
+    connections, further requests wait till a connection is released.
+
+    Multiget workers are daemon threads, kept through the life of the client.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RiakClient, self).__init__(*args, **kwargs)
+        self._node_counter = itertools.count()
+        if settings.RIAK_MAX_CONNECTIONS:
+            limit_pool(self._http_pool, settings.RIAK_MAX_CONNECTIONS)
+            limit_pool(self._tcp_pool, settings.RIAK_MAX_CONNECTIONS)
+
+    def _choose_node(self, nodes=None):
+        nodes = nodes or self.nodes
+        healthy = [node for node in nodes
+                   if node.error_rate.value() < settings.RIAK_NODE_ERROR_RATE]
+        if not healthy:
+            return min(nodes, key=lambda node: node.error_rate.value())
+        return healthy[next(self._node_counter) % len(healthy)]
+
+    @lazy_property
+    def _multiget_pool(self):
+        if self._multiget_pool_size:
+            return MultiGetPool(self._multiget_pool_size)
+
+
+def limit_pool(pool, size):
+    """
+    Makes given riak connection pool block when ``size`` connections are
+    claimed, instead of opening new ones.
+
+    Args:
+        pool: riak.transports.pool.Pool instance.
+        size (int): Max number of connections.
+    """
+    slots = threading.BoundedSemaphore(size)
+    acquire, release, delete_resource = pool.acquire, pool.release, pool.delete_resource
+
+    def free_slot(resource):
+        # errored resources are deleted instead of released, sometimes both
+        if getattr(resource, '_has_slot', False):
+            resource._has_slot = False
+            slots.release()
+
+    def limited_acquire(*args, **kwargs):
+        slots.acquire()
+        try:
+            resource = acquire(*args, **kwargs)
+        except Exception:
+            slots.release()
+            raise
+        resource._has_slot = True
+        return resource
+
+    def limited_release(resource):
+        try:
+            release(resource)
+        finally:
+            free_slot(resource)
+
+    def limited_delete_resource(resource):
+        try:
+            delete_resource(resource)
+        finally:
+            free_slot(resource)
+
+    pool.acquire = limited_acquire
+    pool.release = limited_release
+    pool.delete_resource = limited_delete_resource
+
+
+def get_riak_nodes():
+    """
+    Parses ``settings.RIAK_NODES``, a comma separated list of
+    host[:http_port[:pb_port]] addresses. Defaults to ``settings.RIAK_SERVER``.
+
+    Returns:
+        List of node dicts for riak client.
+    """
+    nodes = []
+    for node in (settings.RIAK_NODES or settings.RIAK_SERVER).split(','):
+        host, _, ports = node.strip().partition(':')
+        http_port, _, pb_port = ports.partition(':')
+        nodes.append({'host': host,
+                      'http_port': int(http_port or settings.RIAK_PORT),
+                      'pb_port': int(pb_port or settings.RIAK_PB_PORT)})
+    return nodes
+
+
+def _close_client(riak_client, pid):
+    # forked processes inherit the handler but not the client's threads and sockets
+    if os.getpid() == pid:
+        riak_client.close()
+
+
+def create_client():
+    kwargs = {}
+    if settings.RIAK_MULTIGET_POOL_SIZE:
+        kwargs['multiget_pool_size'] = settings.RIAK_MULTIGET_POOL_SIZE
+    riak_client = RiakClient(protocol=settings.RIAK_PROTOCOL, nodes=get_riak_nodes(), **kwargs)
+    atexit.register(_close_client, riak_client, os.getpid())
+    return riak_client
+
+
+def create_cache():
+    redis_host, redis_port = settings.REDIS_SERVER.split(':')
+    return Redis(connection_pool=ConnectionPool(host=redis_host,
+                                                port=int(redis_port),
+                                                password=settings.REDIS_PASSWORD,
+                                                max_connections=settings.REDIS_MAX_CONNECTIONS))
+
+
+cache = ProcessLocal(create_cache)
 
-redis_host, redis_port = settings.REDIS_SERVER.split(':')
-cache = Redis(redis_host, redis_port)
+client = ProcessLocal(create_client)
 
-client = riak.RiakClient(protocol=settings.RIAK_PROTOCOL,
-                         host=settings.RIAK_SERVER,
-                         http_port=settings.RIAK_PORT)
+log_bucket = ProcessLocal(lambda: client.bucket_type(
+    settings.VERSION_LOG_BUCKET_TYPE).bucket(settings.ACTIVITY_LOGGING_BUCKET))
 
-log_bucket = client.bucket_type(
-    settings.VERSION_LOG_BUCKET_TYPE).bucket(settings.ACTIVITY_LOGGING_BUCKET)
+version_bucket = ProcessLocal(lambda: client.bucket_type(
+    settings.VERSION_LOG_BUCKET_TYPE).bucket(settings.VERSION_BUCKET))
 
-version_bucket = client.bucket_type(
-    settings.VERSION_LOG_BUCKET_TYPE).bucket(settings.VERSION_BUCKET)
\ No newline at end of file
+# long-lived pool of daemon threads, to fetch objects in parallel
+# without starting and stopping threads on each fetch
+fetch_pool = ProcessLocal(lambda: ThreadPool(settings.RIAK_FETCH_CONCURRENCY))
@@ -0,0 +1,228 @@
+# -*-  coding: utf-8 -*-
+"""
+Instrumentation hooks for DB operations.
+
+Adapter emits an event for each compiled query, Solr search, Riak fetch
+and store, cache lookup and model serialization. Riak store events have
+a ``kind`` of ``object``, ``version`` or ``log``. Listeners are plain
+callables which take an Event.
+
+.. code-block:: python
+
+    from pyoko.db.instrumentation import instrumentation, Histogram
+
+    histogram = Histogram()
+    instrumentation.add_listener(histogram)
+    # or only for some events
+    instrumentation.add_listener(print, events=['solr_executed'])
+    ...
+    histogram.summary()['solr_executed']['p95']
+
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import logging
+import sys
+import threading
+import time
+from collections import namedtuple, deque, defaultdict
+
+from pyoko.conf import settings
+
+log = logging.getLogger(__name__)
+
+QUERY_COMPILED = 'query_compiled'
+SOLR_EXECUTED = 'solr_executed'
+RIAK_GET = 'riak_get'
+RIAK_STORE = 'riak_store'
+CACHE_HIT = 'cache_hit'
+CACHE_MISS = 'cache_miss'
+SERIALIZE = 'serialize'
+INDEX_WAIT = 'index_wait'
+
+#: name: event name, one of the constants above
+#: model: name of the model class
+#: duration: seconds
+#: size: number of objects or bytes, depending on the event
+#: data: dict of event specific details. eg: query, keys
+Event = namedtuple('Event', 'name model duration size timestamp data')
+
+
+class Instrumentation(object):
+    """
+    Dispatches events to registered listeners.
+    Errors of listeners are logged, never raised to the caller.
+    """
+
+    def __init__(self):
+        # replaced, not updated in place, so emit() can iterate without locking
+        self.listeners = ()
+        self._lock = threading.Lock()
+        self._configured = False
+
+    def _configure(self):
+        # default listeners depend on settings, which are loaded lazily
+        with self._lock:
+            if not self._configured:
+                self._configured = True
+                if settings.DEBUG:
+                    self.listeners += ((legacy_stat_counter, None),)
+
+    def add_listener(self, listener, events=None):
+        """
+        Args:
+            listener (callable): Called with an Event instance.
+            events (list): Event names to listen. Defaults to all events.
+        """
+        with self._lock:
+            self.listeners += ((listener, frozenset(events) if events else None),)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            self.listeners = tuple(l for l in self.listeners if l[0] is not listener)
+
+    def emit(self, name, model, duration=0.0, size=0, **data):
+        if not self._configured:
+            self._configure()
+        if not self.listeners:
+            return
+        event = Event(name, model, duration, size, time.time(), data)
+        for listener, events in self.listeners:
+            if events is None or name in events:
+                try:
+                    listener(event)
+                except Exception:
+                    log.exception("Instrumentation listener %r failed" % listener)
+
+
+instrumentation = Instrumentation()
+
+
+class RingBuffer(object):
+    """
+    Keeps last ``size`` events.
+
+    Args:
+        size (int): Defaults to ``settings.INSTRUMENTATION_BUFFER_SIZE``
+    """
+
+    def __init__(self, size=None):
+        self.events = deque(maxlen=size or settings.INSTRUMENTATION_BUFFER_SIZE)
+
+    def __call__(self, event):
+        self.events.append(event)
+
+    def slowest(self, n=10, name=None):
+        """
+        Returns:
+            n slowest events in the buffer, optionally filtered by event name.
+        """
+        events = [e for e in list(self.events) if name is None or e.name == name]
+        return sorted(events, key=lambda e: e.duration, reverse=True)[:n]
+
+
+class Histogram(object):
+    """
+    Aggregates durations of events per event name into fixed buckets.
+    Memory usage doesn't grow with the number of events.
+    """
+    #: upper bounds of buckets in seconds
+    BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, float('inf'))
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = defaultdict(lambda: {'count': 0,
+                                               'size': 0,
+                                               'total': 0.0,
+                                               'min': float('inf'),
+                                               'max': 0.0,
+                                               'buckets': [0] * len(self.BOUNDS)})
+
+    def __call__(self, event):
+        with self._lock:
+            stat = self._stats[event.name]
+            stat['count'] += 1
+            stat['size'] += event.size
+            stat['total'] += event.duration
+            stat['min'] = min(stat['min'], event.duration)
+            stat['max'] = max(stat['max'], event.duration)
+            for i, bound in enumerate(self.BOUNDS):
+                if event.duration <= bound:
+                    stat['buckets'][i] += 1
+                    break
+
+    def _percentile(self, stat, ratio):
+        # upper bound of the bucket that contains the percentile
+        threshold = stat['count'] * ratio
+        seen = 0
+        for bound, count in zip(self.BOUNDS, stat['buckets']):
+            seen += count
+            if seen >= threshold:
+                return min(bound, stat['max'])
+        return stat['max']
+
+    def summary(self):
+        """
+        Returns:
+            Dict of count, size, total, min, max, avg, p50, p95, p99 per event name.
+            Percentiles are approximated by bucket bounds.
+        """
+        result = {}
+        with self._lock:
+            for name, stat in self._stats.items():
+                result[name] = {
+                    'count': stat['count'],
+                    'size': stat['size'],
+                    'total': stat['total'],
+                    'min': stat['min'],
+                    'max': stat['max'],
+                    'avg': stat['total'] / stat['count'],
+                    'p50': self._percentile(stat, .5),
+                    'p95': self._percentile(stat, .95),
+                    'p99': self._percentile(stat, .99),
+                }
+        return result
+
+
+class LegacyStatCounter(object):
+    """
+    Keeps sys.PYOKO_STAT_COUNTER and sys.PYOKO_LOGS up to date for
+    backwards compatibility. Logged keys are kept in bounded buffers.
+    """
+
+    def __init__(self, size=None):
+        self.size = size
+        sys.PYOKO_STAT_COUNTER = {
+            "save": 0,
+            "update": 0,
+            "read": 0,
+            "count": 0,
+            "search": 0,
+        }
+        sys.PYOKO_LOGS = defaultdict(
+            lambda: deque(maxlen=self.size or settings.INSTRUMENTATION_BUFFER_SIZE))
+
+    def __call__(self, event):
+        if event.name == RIAK_GET:
+            sys.PYOKO_STAT_COUNTER['read'] += event.size
+            sys.PYOKO_LOGS[event.model].extend(event.data['keys'])
+        elif event.name == RIAK_STORE and event.data.get('kind') == 'object':
+            if event.data['new']:
+                sys.PYOKO_STAT_COUNTER['save'] += 1
+                sys.PYOKO_LOGS['new'].append(event.data['key'])
+            else:
+                sys.PYOKO_STAT_COUNTER['update'] += 1
+                sys.PYOKO_LOGS[event.model].append(event.data['key'])
+        elif event.name == SOLR_EXECUTED:
+            sys.PYOKO_STAT_COUNTER['search'] += 1
+
+
+# listens all events in DEBUG mode
+legacy_stat_counter = LegacyStatCounter()
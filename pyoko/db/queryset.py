@@ -7,23 +7,16 @@ this module contains a base class for other db access classes
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
+import sys
 from collections import defaultdict
-import copy
 from enum import Enum
 from .adapter.db_riak import Adapter
-from pyoko.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
-import sys
-
-ReturnType = Enum('ReturnType', 'Object Model')
+from .uniqueness import UniquenessChecker
+from pyoko.conf import settings
+from pyoko.exceptions import MultipleObjectsReturned, ObjectDoesNotExist, NotCompatible
+from pyoko.record import get_record_class, get_hidden_fields
 
-sys.PYOKO_STAT_COUNTER = {
-    "save": 0,
-    "update": 0,
-    "read": 0,
-    "count": 0,
-    "search": 0,
-}
-sys.PYOKO_LOGS = defaultdict(list)
+ReturnType = Enum('ReturnType', 'Object Model Record')
 
 
 # noinspection PyTypeChecker
@@ -83,24 +76,97 @@ class QuerySet(object):
         return self.adapter.distinct_values_of(field)
 
     def __iter__(self):
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         for data, key in clone.adapter:
-            yield (
-                clone._make_model(data, key) if self._cfg['rtype'] == ReturnType.Model else (data, key))
+            yield clone._make_result(data, key)
+
+    def iterator(self, chunk_size=None):
+        """
+        Lazily iterates over all matching objects with constant memory usage,
+        to be used instead of plain iteration for large result sets.
+
+        Results are fetched in chunks ordered by key, each chunk
+        selected by the last key of the previous one. Sliced querysets
+        are iterated as usual.
+
+        Args:
+            chunk_size (int): Number of objects to fetch per query.
+                Defaults to row_size of the queryset.
+
+        Yields:
+            Model instances or (data, key) tuples, depending on the return type.
+
+        Example:
+            >>> for person in Person.objects.filter(age__gte=16).iterator(chunk_size=500):
+            ...     print(person.name)
+        """
+        if self._start or self._rows:
+            for item in self:
+                yield item
+            return
+        clone = self._clone()
+        for data, key in clone.adapter.iterator(chunk_size or self._cfg['row_size']):
+            yield clone._make_result(data, key)
+
+    def scan(self, chunk_size=None, concurrency=None, checkpoint=None, on_checkpoint=None,
+             include_deleted=False):
+        """
+        Iterates over all objects of the model, reading them directly from Riak.
+
+        Unlike the other methods, doesn't use Solr. So it works even
+        when the index is not in sync, e.g. in migrations or re-indexing.
+        Query filters are not supported.
+        Checkpoints need a Riak backend with secondary indexes, see Adapter.scan().
+
+        Args:
+            chunk_size (int): Number of keys to list and fetch at once.
+                Defaults to ``settings.MULTIGET_CHUNK_SIZE``
+            concurrency (int): Max number of chunks to fetch in parallel.
+                Defaults to ``settings.SCAN_CONCURRENCY``
+            checkpoint (str): Checkpoint of a previous scan to resume from.
+            on_checkpoint (callable): Called with a checkpoint after each chunk
+                is consumed, None when the scan is completed.
+            include_deleted (bool): Also yield objects marked as deleted.
+
+        Yields:
+            Model instances or (data, key) tuples, depending on the return type.
+
+        Raises:
+            NotCompatible: If the queryset is filtered.
+
+        Example:
+            .. code-block:: python
+
+                for person in Person.objects.scan(on_checkpoint=save_checkpoint):
+                    migrate(person)
+
+                # resume after a failure
+                for person in Person.objects.scan(checkpoint=load_checkpoint()):
+                    migrate(person)
+        """
+        if self.adapter._solr_query or self.adapter.compiled_query:
+            raise NotCompatible("scan() reads all objects from Riak, it can't be filtered")
+        clone = self._clone()
+        clone.adapter.want_deleted = include_deleted
+        for data, key in clone.adapter.scan(chunk_size or settings.MULTIGET_CHUNK_SIZE,
+                                            concurrency or settings.SCAN_CONCURRENCY,
+                                            checkpoint, on_checkpoint):
+            if data.get('deleted') and not include_deleted:
+                clone.adapter._vclocks.pop(key, None)
+                continue
+            yield clone._make_result(data, key)
 
     def __len__(self):
-        return copy.deepcopy(self).adapter.count()
+        return self._clone().adapter.count()
 
     def __getitem__(self, index):
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         if isinstance(index, int):
             # Adjust the index if a slice was defined previously
             adjusted_index = index + (self._start or 0)
             clone.adapter.set_params(rows=1, start=adjusted_index)
             data, key = clone.adapter.get_one()
-            return (clone._make_model(data, key)
-                    if clone._cfg['rtype'] == ReturnType.Model
-                    else (data, key))
+            return clone._make_result(data, key)
         elif isinstance(index, slice):
             if index.start is not None:
                 start = int(index.start)
@@ -124,22 +190,29 @@ class QuerySet(object):
         else:
             raise TypeError("index must be int or slice")
 
+    def _clone(self):
+        """
+        Creates a copy of the queryset to apply further changes on.
+
+        Adapter is cloned without re-initialization, so model class,
+        context and Riak bucket are shared.
+
+        Returns:
+            QuerySet instance.
+        """
+        obj = self.__class__.__new__(self.__class__)
+        obj.__dict__.update(self.__dict__)
+        obj._cfg = self._cfg.copy()
+        obj.adapter = self.adapter._clone()
+        obj.is_clone = True
+        return obj
+
     def __deepcopy__(self, memo=None):
         """
         A deep copy method that doesn't populate caches
         and shares Riak client and bucket
         """
-        obj = self.__class__(**self._cfg)
-        for k, v in self.__dict__.items():
-            if k.endswith(('current_context', 'model', 'model_class')):
-                obj.__dict__[k] = v
-            elif k == '_cfg':
-                obj._cfg = v.copy()
-            else:
-                if k == '_cfg': print("CFG %s" % v.keys())
-                obj.__dict__[k] = copy.deepcopy(v, memo)
-        obj.is_clone = True
-        return obj
+        return self._clone()
 
     def save_model(self, model, meta_data=None, index_fields=None):
         """
@@ -155,6 +228,50 @@ class QuerySet(object):
         #     self._model = model
         return self.adapter.save_model(model, meta_data, index_fields)
 
+    def bulk_save(self, models, meta=None, index_fields=None):
+        """
+        Saves given model instances with bounded parallelism.
+        Much faster than calling save() of each instance for big imports.
+
+        Note:
+            Post/pre save hooks and relation updates are NOT triggered.
+
+        Args:
+            models (list): Model instances.
+            meta (dict): JSON serializable meta data for logging of save operations.
+            index_fields (list): Tuple list for secondary indexing keys in riak (with 'bin' or 'int').
+
+        Returns:
+            List of saved keys.
+
+        Raises:
+            IntegrityError: If unique or unique_together checks of a new object does not pass,
+                or new objects have the same unique values.
+
+        Example:
+            >>> Person.objects.bulk_save([Person(name=name) for name in names])
+        """
+        new_models = defaultdict(list)
+        for model in models:
+            if not model.exist:
+                new_models[model.__class__].append(model)
+        for mdl_models in new_models.values():
+            UniquenessChecker(mdl_models[0].objects).check_many(mdl_models)
+        self.adapter.save_models(models, meta, index_fields)
+        return [model.key for model in models]
+
+    def bulk_create(self, models, meta=None, index_fields=None):
+        """
+        Works like bulk_save() but accepts only new (not yet saved) model instances.
+
+        Raises:
+            NotCompatible: If one of the models is already saved.
+        """
+        if any(model.exist for model in models):
+            raise NotCompatible("bulk_create accepts only unsaved model instances, "
+                                "use bulk_save instead.")
+        return self.bulk_save(models, meta, index_fields)
+
     # def _get(self):
     #     """
     #     executes solr query if needed then returns first object according to
@@ -182,8 +299,37 @@ class QuerySet(object):
         model = self._model_class(self._current_context,
                                   _pass_perm_checks=self._pass_perm_checks)
         model.setattr('key', key if key else data.get('key'))
+        model.setattr('_vclock', self.adapter._vclocks.pop(model.key, None))
         return model.set_data(data, from_db=True)
 
+    def _make_record(self, data, key=None):
+        """
+        Creates a read-only record with the given data.
+
+        Args:
+            data: Model data returned from DB.
+            key: Object key
+        Returns:
+            pyoko.record.Record object.
+        """
+        if data['deleted'] and not self.adapter.want_deleted:
+            raise ObjectDoesNotExist('Deleted object returned')
+        return get_record_class(self._model_class)(
+            data, key if key else data.get('key'), self._current_context,
+            get_hidden_fields(self._model_class, self._current_context))
+
+    def _make_result(self, data, key=None):
+        """
+        Returns:
+            Model instance, record or (data, key) tuple, depending on the return type.
+        """
+        if self._cfg['rtype'] == ReturnType.Model:
+            return self._make_model(data, key)
+        self.adapter._vclocks.pop(key, None)
+        if self._cfg['rtype'] == ReturnType.Record:
+            return self._make_record(data, key)
+        return data, key
+
     def __repr__(self):
         if not self.is_clone:
             return "QuerySet for %s" % self._model_class
@@ -215,7 +361,7 @@ class QuerySet(object):
             >>> # Assume u1 and u2 as related model instances.
             >>> Person.objects.filter(work_unit__in=[u1, u2], name__startswith='jo')
         """
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         clone.adapter.add_query(filters.items())
         return clone
 
@@ -304,7 +450,7 @@ class QuerySet(object):
         """
         do_simple_update = kwargs.get('simple_update', True)
         no_of_updates = 0
-        for model in self:
+        for model in self.iterator():
             no_of_updates += 1
             model._load_data(kwargs)
             model.save(internal=True)
@@ -322,21 +468,16 @@ class QuerySet(object):
         Raises:
             MultipleObjectsReturned: If there is more than one (1) record is returned.
         """
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         # If we are in a slice, adjust the start and rows
         if self._start:
             clone.adapter.set_params(start=self._start)
         if self._rows:
             clone.adapter.set_params(rows=self._rows)
-        if key:
-            data, key = clone.adapter.get(key)
-        elif kwargs:
-            data, key = clone.filter(**kwargs).adapter.get()
-        else:
-            data, key = clone.adapter.get()
-        if clone._cfg['rtype'] == ReturnType.Object:
-            return data, key
-        return self._make_model(data, key)
+        if not key and kwargs:
+            clone = clone.filter(**kwargs)
+        data, key = clone.adapter.get(key)
+        return clone._make_result(data, key)
 
     def delete(self):
         """
@@ -354,9 +495,7 @@ class QuerySet(object):
             >>> Person.objects.filter(age__gte=16, name__startswith='jo').delete()
 
         """
-        clone = copy.deepcopy(self)
-        # clone.adapter.want_deleted = True
-        return [item.delete() and item for item in clone]
+        return [item.delete() and item for item in self.iterator()]
 
     def values_list(self, *args, **kwargs):
         """
@@ -369,27 +508,41 @@ class QuerySet(object):
             flatten (bool): True. Flatten if there is only one field name given.
              Returns ['one','two', 'three'] instead of
              [['one'], ['two'], ['three]]
+            from_solr (bool): False. Read the values from stored fields of
+             Solr documents instead of fetching every object from Riak.
+             All given fields should be stored in Solr schema. Values are
+             converted to their stored formats, except that Solr keeps
+             dates with millisecond precision.
             \*args: List of fields to be retured as list.
 
         Returns:
             List of deleted objects or None if *confirm* not set.
 
+        Raises:
+            NotCompatible: If from_solr is set and one of the fields is not stored.
+
         Example:
             >>> Person.objects.filter(age__gte=16).values_list('name', 'lastname')
+            >>> Person.objects.filter(age__gte=16).values_list('key', 'name', from_solr=True)
 
         """
         results = []
-        for data, key in self.data():
-            results.append([data[val] if val != 'key' else key for val in args])
+        if kwargs.get('from_solr'):
+            clone = self._clone()
+            results.extend(clone.adapter.iter_projection(args))
+        else:
+            for data, key in self.data():
+                results.append([data[val] if val != 'key' else key for val in args])
         return results if len(args) > 1 or not kwargs.get('flatten', True) else [
             i[0] for i in results]
 
-    def values(self, *args):
+    def values(self, *args, **kwargs):
         """
         Returns list of dicts (field names as keys) for given fields.
 
         Args:
             \*args: List of fields to be returned as dict.
+            from_solr (bool): False. See values_list() for details.
 
         Returns:
             list of dicts for given fields.
@@ -399,7 +552,9 @@ class QuerySet(object):
 
         """
         return [dict(zip(args, values_list))
-                for values_list in self.values_list(flatten=False, *args)]
+                for values_list in self.values_list(flatten=False,
+                                                    from_solr=kwargs.get('from_solr', False),
+                                                    *args)]
 
     def dump(self):
         """
@@ -428,7 +583,7 @@ class QuerySet(object):
             >>> Person.objects.or_filter(age__gte=16, name__startswith='jo')
 
         """
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         clone.adapter.add_query([("OR_QRY", filters)])
         return clone
 
@@ -439,7 +594,7 @@ class QuerySet(object):
         Returns:
             Self. Queryset object.
         """
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         clone.adapter._QUERY_GLUE = ' OR '
         return clone
 
@@ -468,7 +623,7 @@ class QuerySet(object):
             >>> Person.objects.search_on('name', 'surname', contains='john')
             >>> Person.objects.search_on('name', 'surname', startswith='jo')
         """
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         clone.adapter.search_on(*fields, **query)
         return clone
 
@@ -478,7 +633,7 @@ class QuerySet(object):
         :return:  number of objects matches to the query
         :rtype: int
         """
-        return copy.deepcopy(self).adapter.count()
+        return self._clone().adapter.count()
 
     def _clear(self):
         """
@@ -501,7 +656,7 @@ class QuerySet(object):
         Examples:
             >>> Person.objects.order_by('-name', 'join_date')
         """
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         clone.adapter.order_by(*args)
         return clone
 
@@ -509,7 +664,7 @@ class QuerySet(object):
         """
         add/update solr query parameters
         """
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         clone.adapter.set_params(**params)
         return clone
 
@@ -517,10 +672,51 @@ class QuerySet(object):
         """
         return (data_dict, key) tuple instead of models instances
         """
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         clone._cfg['rtype'] = ReturnType.Object
         return clone
 
+    def records(self):
+        """
+        Returns read-only records instead of model instances.
+
+        Records are much cheaper to create than models, as their fields
+        are converted and linked models are fetched on first access,
+        nodes are not instantiated. See pyoko.record.Record.
+
+        Example:
+            >>> for person in Person.objects.filter(age__gte=16).records().iterator():
+            ...     print(person.name, person.father_id)
+        """
+        clone = self._clone()
+        clone._cfg['rtype'] = ReturnType.Record
+        return clone
+
+    def aio(self, executor=None):
+        """
+        Returns an asyncio interface of this queryset.
+        Requires Python 3.7+
+
+        Args:
+            executor: Executor to run blocking DB calls.
+                Defaults to a shared one with ``settings.ASYNC_DB_THREADS`` threads.
+
+        Returns:
+            AsyncQuerySet object.
+
+        Raises:
+            NotCompatible: On Python versions older than 3.7.
+
+        Example:
+            >>> async for person in Person.objects.filter(name='John').aio():
+            >>> person = await Person.objects.aio().get(key)
+        """
+        # async modules use syntax that older interpreters can't parse
+        if sys.version_info < (3, 7):
+            raise NotCompatible("aio() requires Python 3.7+")
+        from .queryset_async import AsyncQuerySet
+        return AsyncQuerySet(self._clone(), executor)
+
     def raw(self, query):
         """
         make a raw query
@@ -529,7 +725,7 @@ class QuerySet(object):
         query (str): solr query
         \*\*params: solr parameters
         """
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         clone.adapter._pre_compiled_query = query
         clone.adapter.compiled_query = query
         return clone
@@ -0,0 +1,107 @@
+# -*-  coding: utf-8 -*-
+"""
+asyncio counterpart of the QuerySet.
+
+Requires Python 3.7+
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+from .adapter.db_riak_async import AsyncAdapter
+
+
+class AsyncQuerySet(object):
+    """
+    Awaitable interface for a QuerySet. Use QuerySet.aio() to get one.
+    Filtering methods work like their QuerySet equivalents.
+
+    .. code-block:: python
+
+        async for student in Student.objects.filter(name='Jack').aio():
+            print(student.surname)
+
+        count = await Student.objects.aio().filter(name='Jack').count()
+        student = await Student.objects.aio().get(key)
+        await Student.objects.aio().save(student)
+
+    Args:
+        queryset (QuerySet): QuerySet to run the queries of.
+        executor: Executor to run blocking DB calls.
+    """
+
+    def __init__(self, queryset, executor=None):
+        self.queryset = queryset
+        self.executor = executor
+
+    def _chain(self, queryset):
+        return self.__class__(queryset, self.executor)
+
+    def _adapter(self, queryset):
+        return AsyncAdapter(queryset.adapter, self.executor)
+
+    def filter(self, **filters):
+        return self._chain(self.queryset.filter(**filters))
+
+    def exclude(self, **filters):
+        return self._chain(self.queryset.exclude(**filters))
+
+    def or_filter(self, **filters):
+        return self._chain(self.queryset.or_filter(**filters))
+
+    def search_on(self, *fields, **query):
+        return self._chain(self.queryset.search_on(*fields, **query))
+
+    def order_by(self, *args):
+        return self._chain(self.queryset.order_by(*args))
+
+    def set_params(self, **params):
+        return self._chain(self.queryset.set_params(**params))
+
+    def raw(self, query):
+        return self._chain(self.queryset.raw(query))
+
+    def data(self):
+        return self._chain(self.queryset.data())
+
+    def records(self):
+        return self._chain(self.queryset.records())
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError("only slicing supported, use get() for a single object")
+        return self._chain(self.queryset[index])
+
+    async def __aiter__(self):
+        clone = self.queryset._clone()
+        async for data, key in self._adapter(clone).iterate():
+            yield clone._make_result(data, key)
+
+    async def count(self):
+        clone = self.queryset._clone()
+        return await self._adapter(clone).count()
+
+    async def get(self, key=None, **kwargs):
+        """
+        See QuerySet.get()
+        """
+        return await self._adapter(self.queryset).run(self.queryset.get, key, **kwargs)
+
+    async def save(self, model, internal=False, meta=None, index_fields=None):
+        """
+        Saves given model instance through its save() method,
+        so hooks, uniqueness checks and relations work as usual.
+
+        Returns:
+            Saved model instance.
+        """
+        return await self._adapter(self.queryset).run(model.save, internal=internal, meta=meta,
+                                                      index_fields=index_fields)
+
+    async def delete(self, model, meta=None, index_fields=None):
+        """
+        Deletes given model instance through its delete() method.
+        """
+        return await self._adapter(self.queryset).run(model.delete, meta=meta,
+                                                      index_fields=index_fields)
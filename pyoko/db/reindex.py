@@ -0,0 +1,224 @@
+# -*-  coding: utf-8 -*-
+"""
+Parallel re-indexing of model objects.
+
+Objects are read with QuerySet.scan() and stored back to Riak
+by a pool of workers, which triggers re-indexing of them in Solr.
+Save hooks, uniqueness checks, version and log writes are skipped.
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+from __future__ import print_function
+import json
+import logging
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from riak import ConflictError
+
+from pyoko.conf import settings
+
+log = logging.getLogger(__name__)
+
+
+class RateLimiter(object):
+    """
+    Blocks the caller to keep the rate of calls under given limit.
+
+    Args:
+        rate (float): Max calls per second. Zero or None means unlimited.
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.started = time.time()
+        self.calls = 0
+
+    def wait(self):
+        if not self.rate:
+            return
+        self.calls += 1
+        delay = self.started + self.calls / float(self.rate) - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Checkpoint(object):
+    """
+    Keeps scan checkpoints of models in a JSON file,
+    so an interrupted re-index can be resumed.
+
+    Args:
+        path (str): Path of the checkpoint file. If None, nothing is persisted.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.state = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def get(self, model_name):
+        """
+        Returns:
+            (done, checkpoint) tuple of the model.
+        """
+        state = self.state.get(model_name, {})
+        return state.get('done', False), state.get('checkpoint')
+
+    def set(self, model_name, checkpoint, done=False):
+        self.state[model_name] = {'checkpoint': checkpoint, 'done': done}
+        if not self.path:
+            return
+        # written to a temp file first, so a crash can't leave a truncated file behind
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.rename(tmp_path, self.path)
+
+
+class Reindexer(object):
+    """
+    Re-stores all objects of given models with a pool of workers.
+
+    In raw mode, stored data of objects are written back as is.
+    Otherwise objects are loaded into model instances and serialized
+    again, so changes in model definitions are reflected to stored data.
+
+    Checkpoints are not advanced after a failed store, so resuming
+    retries the failed keys.
+
+    Args:
+        models (list): Model classes.
+        workers (int): Number of worker threads.
+        raw (bool): Store objects without round-tripping through the model.
+        rate (float): Max number of objects to store per second. Unlimited if not set.
+        checkpoint_path (str): Path of the checkpoint file to resume from and update.
+        chunk_size (int): Number of keys to list and fetch at once.
+        report_interval (float): Seconds between progress reports.
+    """
+
+    def __init__(self, models, workers=8, raw=False, rate=None, checkpoint_path=None,
+                 chunk_size=None, report_interval=5):
+        self.models = models
+        self.workers = workers
+        self.raw = raw
+        self.rate = rate
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.chunk_size = chunk_size
+        self.report_interval = report_interval
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._in_flight = 0
+
+    def run(self):
+        """
+        Re-indexes all models.
+
+        Returns:
+            Dict of failed keys per model name.
+        """
+        failed = {}
+        for mdl in self.models:
+            done, checkpoint = self.checkpoint.get(mdl.__name__)
+            if done:
+                print("Skipping %s, already re-indexed" % mdl.__name__)
+                continue
+            failed[mdl.__name__] = self.reindex_model(mdl, checkpoint)
+        return failed
+
+    def reindex_model(self, mdl, checkpoint=None):
+        """
+        Args:
+            mdl: Model class.
+            checkpoint (str): Scan checkpoint to resume from.
+
+        Returns:
+            List of keys that cannot be stored.
+        """
+        name = mdl.__name__
+        self.count = 0
+        self.failed_keys = []
+        queryset = mdl.objects._clone()
+        queryset.adapter.want_deleted = True
+        # at most two objects per worker are waiting in the pool
+        slots = threading.BoundedSemaphore(self.workers * 2)
+        limiter = RateLimiter(self.rate)
+        pool = ThreadPool(self.workers)
+
+        def on_checkpoint(next_checkpoint):
+            # objects before the checkpoint should be stored before it's persisted
+            self._wait_idle()
+            # after a failure, resuming starts from the last checkpoint before it,
+            # so failed keys are retried
+            if not self.failed_keys:
+                self.checkpoint.set(name, next_checkpoint, done=next_checkpoint is None)
+
+        def store(obj):
+            try:
+                self._store(queryset, obj)
+            except Exception as e:
+                with self._lock:
+                    self.failed_keys.append(obj.key)
+                if isinstance(e, ConflictError):
+                    log.error("Record in conflict: %s > %s" % (name, obj.key))
+                else:
+                    log.exception("Error on save! %s > %s" % (name, obj.key))
+            finally:
+                with self._lock:
+                    self.count += 1
+                    self._in_flight -= 1
+                    self._idle.notify_all()
+                slots.release()
+
+        t1 = last_report = time.time()
+        if checkpoint:
+            print("Resuming re-indexing of %s" % name)
+        try:
+            for obj in queryset.adapter.scan_objects(
+                    self.chunk_size or settings.MULTIGET_CHUNK_SIZE, self.workers,
+                    checkpoint, on_checkpoint if self.checkpoint.path else None):
+                limiter.wait()
+                slots.acquire()
+                with self._lock:
+                    self._in_flight += 1
+                pool.apply_async(store, (obj,))
+                if time.time() - last_report >= self.report_interval:
+                    last_report = time.time()
+                    self._report(name, t1)
+            self._wait_idle()
+            if not self.failed_keys:
+                self.checkpoint.set(name, None, done=True)
+        finally:
+            pool.close()
+            pool.join()
+        self._report(name, t1)
+        return self.failed_keys
+
+    def _store(self, queryset, obj):
+        # empty objects have nothing to re-index
+        if not obj.data:
+            return
+        if not self.raw:
+            model = queryset._make_model(obj.data, obj.key)
+            # serialize with the current definitions of nodes, not the loaded data
+            model._set_all_dirty()
+            obj.data = model.clean_value()
+        obj.store()
+
+    def _wait_idle(self):
+        with self._lock:
+            while self._in_flight:
+                self._idle.wait()
+
+    def _report(self, name, started):
+        duration = time.time() - started
+        print("Re-indexed %s records of %s in %s seconds (%s/sec), %s failed" % (
+            self.count, name, round(duration, 2),
+            round(self.count / duration, 1) if duration else 0, len(self.failed_keys)))
@@ -9,13 +9,16 @@
 
 from __future__ import print_function
 import codecs
-from random import randint
-from sys import stdout
+import hashlib
+import json
 import threading
+from random import randint
 import time
-from riak import ConflictError, RiakError
+from multiprocessing.pool import ThreadPool
+from riak import RiakError
 from pyoko.conf import settings
 from pyoko.db.connection import client, log_bucket
+from pyoko.db.reindex import Reindexer
 import os, inspect
 from pyoko.lib.utils import un_camel, random_word
 try:
@@ -34,38 +37,56 @@ class FakeContext(object):
 fake_context = FakeContext()
 
 
-def wait_for_schema_creation(index_name):
+def _solr_core_exists(index_name):
     url = 'http://%s:8093/internal_solr/%s/select' % (settings.RIAK_SERVER, index_name)
-    print("pinging solr schema: %s" % url, end='')
-    while True:
-        try:
-            urlopen(url)
-            return
-        except HTTPError as e:
-            if e.code == 404:
-                time.sleep(1)
-                import traceback
-                print(traceback.format_exc())
-            else:
-                raise
+    try:
+        urlopen(url)
+        return True
+    except HTTPError as e:
+        if e.code == 404:
+            return False
+        raise
+
+
+def _poll(check):
+    """
+    Calls check function till it returns True. Polling interval starts from
+    ``settings.SCHEMA_WAIT_MIN_DELAY`` and doubled up to ``settings.SCHEMA_WAIT_MAX_DELAY``
+    after each failed check.
+
+    Returns:
+        Seconds waited.
+    """
+    t1 = time.time()
+    delay = settings.SCHEMA_WAIT_MIN_DELAY
+    while not check():
+        time.sleep(delay)
+        delay = min(delay * 2, settings.SCHEMA_WAIT_MAX_DELAY)
+    return time.time() - t1
+
+
+def wait_for_schema_creation(index_name):
+    return _poll(lambda: _solr_core_exists(index_name))
 
 
 def wait_for_schema_deletion(index_name):
-    url = 'http://%s:8093/internal_solr/%s/select' % (settings.RIAK_SERVER, index_name)
-    i = 0
-    while True:
-        i += 1
-        stdout.write("\r Waiting for actual deletion of solr schema %s %s" % (index_name, i * '.'))
-        stdout.flush()
-        try:
-            urlopen(url)
-            time.sleep(1)
-        except HTTPError as e:
-            print("")
-            if e.code == 404:
-                return
-            else:
-                raise
+    return _poll(lambda: not _solr_core_exists(index_name))
+
+
+_schema_template = None
+
+
+def get_schema_template():
+    """
+    Returns:
+        Contents of solr_schema_template.xml, read once per process.
+    """
+    global _schema_template
+    if _schema_template is None:
+        path = os.path.dirname(os.path.realpath(__file__))
+        with codecs.open("%s/solr_schema_template.xml" % path, 'r', 'utf-8') as fh:
+            _schema_template = fh.read()
+    return _schema_template
 
 
 def get_schema_from_solr(index_name):
@@ -80,6 +101,53 @@ def get_schema_from_solr(index_name):
             raise
 
 
+class SchemaCache(object):
+    """
+    Locally persisted fingerprints of the schemas applied to Solr,
+    to decide that a schema is up to date without asking to Solr.
+
+    Fingerprints are kept per Riak server and index name, in the JSON file
+    at ``settings.SCHEMA_CACHE_FILE``. If an index is changed out of
+    this process, migrate with force to re-sync.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or settings.SCHEMA_CACHE_FILE
+        self._lock = threading.Lock()
+        self.fingerprints = {}
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.fingerprints = json.load(f)
+            except ValueError:
+                # corrupted cache file, fingerprints will be re-collected
+                pass
+
+    @staticmethod
+    def fingerprint(schema):
+        return hashlib.sha1(schema).hexdigest()
+
+    @staticmethod
+    def _cache_key(index_name):
+        return "%s/%s" % (settings.RIAK_SERVER, index_name)
+
+    def is_up_to_date(self, index_name, schema):
+        return self.fingerprints.get(self._cache_key(index_name)) == self.fingerprint(schema)
+
+    def set(self, index_name, schema):
+        """
+        Records given schema as the applied schema of the index.
+        """
+        with self._lock:
+            self.fingerprints[self._cache_key(index_name)] = self.fingerprint(schema)
+            if not self.path:
+                return
+            tmp_path = '%s.tmp' % self.path
+            with open(tmp_path, 'w') as f:
+                json.dump(self.fingerprints, f, indent=1, sort_keys=True)
+            os.rename(tmp_path, self.path)
+
+
 class SchemaUpdater(object):
     """
     traverses trough all models, collects fields marked for index or store in solr
@@ -89,17 +157,25 @@ class SchemaUpdater(object):
     FIELD_TEMPLATE = '<field    type="{type}" name="{name}"  indexed="{index}" ' \
                      'stored="{store}" multiValued="{multi}" />'
 
-    def __init__(self, registry, bucket_names, threads, force):
+    def __init__(self, registry, bucket_names, threads, force, workers=8):
         self.report = []
         self.registry = registry
         self.force = force
         self.client = client
         self.threads = int(threads)
+        self.workers = int(workers)
         self.bucket_names = [b.lower() for b in bucket_names.split(',')]
         self.t1 = 0.0  # start time
+        # model name => seconds spent on migration
+        self.timings = {}
+        self.schema_cache = SchemaCache()
 
     def run(self, check_only=False):
         """
+        Migrates models in parallel, ``self.threads`` models at a time.
+        Objects of each model are re-stored by ``self.workers`` threads.
+
+        Riak client pools its connections, so it's shared by all threads.
 
         Args:
             check_only:  do not migrate, only report migration is needed or not if True
@@ -108,36 +184,39 @@ class SchemaUpdater(object):
 
         """
         self.t1 = time.time()
-        apply_threads = []
         models = [model for model in self.registry.get_base_models()
                   if self.bucket_names[0] == 'all' or
                   model.__name__.lower() in self.bucket_names]
         num_models = len(models)
-        pack_size = int(num_models / self.threads) or 1
-        n_val = self.client.bucket_type(settings.DEFAULT_BUCKET_TYPE).get_property('n_val')
-        self.client.create_search_index('foo_index', '_yz_default', n_val=n_val)
-        for i in range(0, num_models, pack_size):
-            job_pack = []
-            for model in models[i:i + pack_size]:
-                ins = model(fake_context)
-                fields = self.get_schema_fields(ins._collect_index_fields())
-                new_schema = self.compile_schema(fields)
-                job_pack.append((new_schema, model))
-            apply_threads.append(
-                threading.Thread(target=self.apply_schema, args=(self.client,
-                                                                 self.force,
-                                                                 job_pack,
-                                                                 check_only)))
+        jobs = []
+        for model in models:
+            ins = model(fake_context)
+            fields = self.get_schema_fields(ins._collect_index_fields())
+            new_schema = self.compile_schema(fields)
+            index_name = self.get_index_name(model)
+            if not self.force and self.schema_cache.is_up_to_date(index_name, new_schema):
+                print("Schema %s is already up to date, nothing to do!" % index_name)
+                continue
+            jobs.append((new_schema, model, check_only))
+        if jobs:
+            n_val = self.client.bucket_type(settings.DEFAULT_BUCKET_TYPE).get_property('n_val')
+            self.client.create_search_index('foo_index', '_yz_default', n_val=n_val)
 
         print("Schema creation started for %s model(s) with max %s threads\n" % (
-            num_models, self.threads))
-        for t in apply_threads:
-            t.start()
-        for t in apply_threads:
-            t.join()
-        if apply_threads:
-            self.report = "\nSchema and index definitions successfully " \
-                          "applied for the models listed above."
+            len(jobs), self.threads))
+        pool = ThreadPool(min(self.threads, len(jobs)) or 1)
+        try:
+            # models are handed out one by one, so threads don't wait for each other
+            pool.map(lambda job: self.apply_schema(*job), jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        if models:
+            self.report = "\n".join(
+                ["%s: %s secs" % (name, round(duration, 2))
+                 for name, duration in sorted(self.timings.items())] +
+                ["\nSchema and index definitions successfully "
+                 "applied for the models listed above."])
 
     def create_report(self):
         """
@@ -176,15 +255,13 @@ class SchemaUpdater(object):
         :return: compiled schema
         :rtype: byte
         """
-        path = os.path.dirname(os.path.realpath(__file__))
-        # path = os.path.dirname(
-        #     os.path.abspath(inspect.getfile(inspect.currentframe())))
-        with codecs.open("%s/solr_schema_template.xml" % path, 'r', 'utf-8') as fh:
-            schema_template = fh.read()
-        return schema_template.format('\n'.join(fields)).encode('utf-8')
+        return get_schema_template().format('\n'.join(fields)).encode('utf-8')
 
     @staticmethod
-    def apply_schema(client, force, job_pack, check_only):
+    def get_index_name(model):
+        return "%s_%s" % (settings.DEFAULT_BUCKET_TYPE, model._get_bucket_name())
+
+    def apply_schema(self, new_schema, model, check_only):
         """
         riak doesn't support schema/index updates ( http://git.io/vLOTS )
 
@@ -193,67 +270,56 @@ class SchemaUpdater(object):
         re-create the index with new schema, assign it to bucket,
         then delete the temporary index.
 
-        :param byte new_schema: compiled schema
-        :param str bucket_name: name of schema, index and bucket.
-        :return: True or False
-        :rtype: bool
+        Args:
+            new_schema (bytes): Compiled schema.
+            model: Model class.
+            check_only (bool): Only report if migration is needed.
         """
-        for new_schema, model in job_pack:
-            try:
-                bucket_name = model._get_bucket_name()
-                bucket_type = client.bucket_type(settings.DEFAULT_BUCKET_TYPE)
-                bucket = bucket_type.bucket(bucket_name)
-                n_val = bucket_type.get_property('n_val')
-                index_name = "%s_%s" % (settings.DEFAULT_BUCKET_TYPE, bucket_name)
-                if not force:
-                    try:
-                        schema = get_schema_from_solr(index_name)
-                        if schema == new_schema:
-                            print("Schema %s is already up to date, nothing to do!" % index_name)
-                            continue
-                        elif check_only and schema != new_schema:
-                            print("Schema %s is not up to date, migrate this model!" % index_name)
-                            continue
-                    except:
-                        import traceback
-                        traceback.print_exc()
-                bucket.set_property('search_index', 'foo_index')
+        t1 = time.time()
+        client = self.client
+        try:
+            bucket_name = model._get_bucket_name()
+            bucket_type = client.bucket_type(settings.DEFAULT_BUCKET_TYPE)
+            bucket = bucket_type.bucket(bucket_name)
+            n_val = bucket_type.get_property('n_val')
+            index_name = self.get_index_name(model)
+            if not self.force:
+                # not in the local cache, compare with the one in Solr
                 try:
-                    client.delete_search_index(index_name)
-                except RiakError as e:
-                    if 'notfound' != e.value:
-                        raise
-                wait_for_schema_deletion(index_name)
-                client.create_search_schema(index_name, new_schema)
-                client.create_search_index(index_name, index_name, n_val)
-                bucket.set_property('search_index', index_name)
-                print("+ %s (%s)" % (model.__name__, index_name))
-                stream = bucket.stream_keys()
-                i = 0
-                unsaved_keys = []
-                for key_list in stream:
-                    for key in key_list:
-                        i += 1
-                        # time.sleep(0.4)
-                        try:
-                            obj = bucket.get(key)
-                            if obj.data:
-                                obj.store()
-                        except ConflictError:
-                            unsaved_keys.append(key)
-                            print("Error on save. Record in conflict: %s > %s" % (bucket_name, key))
-                        except:
-                            unsaved_keys.append(key)
-                            print("Error on save! %s > %s" % (bucket_name, key))
-                            import traceback
-                            traceback.print_exc()
-                stream.close()
-                print("Re-indexed %s records of %s" % (i, bucket_name))
-                if unsaved_keys:
-                    print("\nThese keys cannot be updated:\n\n", unsaved_keys)
-
-            except:
-                print("n_val: %s" % n_val)
-                print("bucket_name: %s" % bucket_name)
-                print("bucket_type: %s" % bucket_type)
-                raise
+                    schema = get_schema_from_solr(index_name)
+                    if schema == new_schema:
+                        print("Schema %s is already up to date, nothing to do!" % index_name)
+                        self.schema_cache.set(index_name, new_schema)
+                        return
+                    elif check_only and schema != new_schema:
+                        print("Schema %s is not up to date, migrate this model!" % index_name)
+                        return
+                except:
+                    import traceback
+                    traceback.print_exc()
+            bucket.set_property('search_index', 'foo_index')
+            try:
+                client.delete_search_index(index_name)
+            except RiakError as e:
+                if 'notfound' != e.value:
+                    raise
+            wait_for_schema_deletion(index_name)
+            client.create_search_schema(index_name, new_schema)
+            client.create_search_index(index_name, index_name, n_val)
+            wait_for_schema_creation(index_name)
+            bucket.set_property('search_index', index_name)
+            print("+ %s (%s) schema applied in %s secs" % (model.__name__, index_name,
+                                                         round(time.time() - t1, 2)))
+            failed_keys = Reindexer([model], workers=self.workers, raw=True,
+                                    report_interval=60).reindex_model(model)
+            if failed_keys:
+                print("\nThese keys cannot be updated:\n\n", failed_keys)
+            else:
+                # cached only after the new index is populated, so an
+                # interrupted or failed re-index is retried on next migration
+                self.schema_cache.set(index_name, new_schema)
+        except:
+            print("bucket_name: %s" % model._get_bucket_name())
+            raise
+        finally:
+            self.timings[model.__name__] = time.time() - t1
@@ -0,0 +1,147 @@
+# -*-  coding: utf-8 -*-
+"""
+Uniqueness checks of new objects.
+
+Unique fields and unique_together constraints of an object are combined
+into one OR'ed Solr query. In batch mode, constraints of many objects are
+checked with a few combined queries and duplicates within the batch are
+caught in memory.
+
+.. code-block:: python
+
+    UniquenessChecker(Person.objects).check_many(new_people)
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+from collections import namedtuple
+
+from pyoko.conf import settings
+from pyoko.exceptions import IntegrityError
+
+#: names: names of the fields or links
+#: values: values of them in the checked object
+#: together: True for unique_together constraints
+Constraint = namedtuple('Constraint', 'names values together')
+
+
+def _get_value(model, name):
+    try:
+        return model._field_values[name]
+    except KeyError:
+        return getattr(model, name)
+
+
+def _hashable(value):
+    # linked models are compared by their keys
+    return value.key if getattr(value, '_TYPE', None) == 'Model' else value
+
+
+def get_constraints(model):
+    """
+    Args:
+        model: Model instance.
+
+    Returns:
+        List of Constraint tuples of the model. Unique fields without
+        a value are skipped.
+    """
+    constraints = []
+    for name in model._uniques:
+        value = _get_value(model, name)
+        if value:
+            constraints.append(Constraint((name,), (value,), False))
+    for names in model.Meta.unique_together:
+        constraints.append(Constraint(tuple(names),
+                                      tuple(_get_value(model, name) for name in names), True))
+    return constraints
+
+
+class UniquenessChecker(object):
+    """
+    Checks uniqueness constraints of new objects against the stored ones.
+
+    Riak client doesn't return facet counts of Solr responses, so the
+    colliding constraint is found by bisecting the combined query, only
+    after it matches an object.
+
+    Args:
+        queryset: QuerySet of the model, constraint queries are built on it.
+    """
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def check(self, model):
+        """
+        Checks all constraints of the model with one query.
+
+        Args:
+            model: Unsaved model instance.
+
+        Raises:
+            IntegrityError: If a constraint collides with a stored object.
+        """
+        self._check([(model, constraint) for constraint in get_constraints(model)])
+
+    def check_many(self, models):
+        """
+        Checks constraints of given models in chunks of
+        ``settings.UNIQUENESS_CHECK_CHUNK_SIZE`` constraints per query.
+
+        Args:
+            models (list): Unsaved model instances.
+
+        Raises:
+            IntegrityError: If a constraint collides with a stored object
+                or with another object in the batch.
+        """
+        seen = set()
+        items = []
+        for model in models:
+            for constraint in get_constraints(model):
+                items.append((model, constraint))
+                values = tuple(_hashable(v) for v in constraint.values)
+                # empty values (eg: unset links) are not duplicates of each other
+                if any(v is None or v == '' for v in values):
+                    continue
+                if (constraint.names, values) in seen:
+                    raise self._error(model, constraint)
+                seen.add((constraint.names, values))
+        chunk_size = settings.UNIQUENESS_CHECK_CHUNK_SIZE
+        for i in range(0, len(items), chunk_size):
+            self._check(items[i:i + chunk_size])
+
+    def _check(self, items):
+        items = [(model, constraint, self._compile(constraint)) for model, constraint in items]
+        if items and self._count([query for _, _, query in items]):
+            self._find_collision(items)
+
+    def _find_collision(self, items):
+        if len(items) == 1:
+            model, constraint, _ = items[0]
+            raise self._error(model, constraint)
+        half = len(items) // 2
+        for part in (items[:half], items[half:]):
+            if self._count([query for _, _, query in part]):
+                self._find_collision(part)
+
+    def _compile(self, constraint):
+        adapter = self.queryset.filter(**dict(zip(constraint.names, constraint.values))).adapter
+        adapter._compile_query()
+        return adapter.compiled_query
+
+    def _count(self, queries):
+        return self.queryset.raw(' OR '.join('(%s)' % query for query in queries)).count()
+
+    @staticmethod
+    def _error(model, constraint):
+        if constraint.together:
+            return IntegrityError(
+                "Unique together mismatch: %s combination already exists for %s"
+                % (dict(zip(constraint.names, constraint.values)), model.__class__.__name__))
+        return IntegrityError("Unique mismatch: %s for %s already exists for value: %s" %
+                              (constraint.names[0], model.__class__.__name__,
+                               constraint.values[0]))
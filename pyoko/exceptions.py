@@ -32,3 +32,7 @@ class ObjectDoesNotExist(PyokoError):
 class IntegrityError(PyokoError):
     """raised on unique/unique_together mismatches"""
     pass
+
+class IndexSyncTimeout(PyokoError):
+    """raised when saved objects are not reflected to search index in time"""
+    pass
@@ -18,6 +18,19 @@ from pyoko.conf import settings
 DATE_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
 DATE_FORMAT = "%Y-%m-%dT00:00:00Z"
 EMPTY_DATETIME = '0000-00-00T00:00:00Z'
+# Solr returns dates in UTC, with up to millisecond precision
+SOLR_DATE_FORMATS = ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ")
+
+
+def _from_solr_date(val, fmt):
+    if not val:
+        return val
+    for solr_format in SOLR_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(val, solr_format).strftime(fmt)
+        except ValueError:
+            pass
+    return val
 
 # W#W#W#W#W#W#W#W#W#W#W#W#W#W#W#W#W#W#W#W#W#W
 #
@@ -70,6 +83,7 @@ class BaseField(object):
     def __set__(self, instance, value):
         instance._field_values[self.name] = value
         instance._set_get_choice_display_method(self.name, self, value)
+        instance._set_dirty(self.name)
 
 
     def _load_data(self, instance, value):
@@ -87,6 +101,13 @@ class BaseField(object):
             val = self.default() if callable(self.default) else self.default
         return val
 
+    def from_solr(self, val):
+        """
+        Converts a value read from a stored field of a Solr document
+        to the format it's stored in Riak.
+        """
+        return val
+
     def validate(self, val):
         return True
 
@@ -135,6 +156,9 @@ class Float(BaseField):
         except ValueError:
             raise ValidationError("%r could not be cast to float" % val)
 
+    def from_solr(self, val):
+        return val if val is None else float(val)
+
 
 class Boolean(BaseField):
     solr_type = 'boolean'
@@ -146,6 +170,12 @@ class Boolean(BaseField):
         else:
             return bool(val)
 
+    def from_solr(self, val):
+        # protocol buffers transport returns all values as strings
+        if isinstance(val, six.string_types):
+            return val == 'true'
+        return val
+
 
 class DateTime(BaseField):
     solr_type = 'date'
@@ -164,6 +194,9 @@ class DateTime(BaseField):
         else:
             return val.strftime(DATE_TIME_FORMAT)
 
+    def from_solr(self, val):
+        return _from_solr_date(val, DATE_TIME_FORMAT)
+
     def __set__(self, instance, value):
         if value == EMPTY_DATETIME:
             value = None
@@ -216,6 +249,9 @@ class Date(BaseField):
         else:
             return val.strftime(DATE_FORMAT)
 
+    def from_solr(self, val):
+        return _from_solr_date(val, DATE_FORMAT)
+
     def _load_data(self, instance, value):
         if value is None or value == EMPTY_DATETIME:
             value = ''
@@ -245,6 +281,9 @@ class Integer(BaseField):
         else:
             return self.default_value
 
+    def from_solr(self, val):
+        return val if val is None else int(val)
+
 
 class TimeStamp(BaseField):
     solr_type = 'date'
@@ -256,6 +295,9 @@ class TimeStamp(BaseField):
     def clean_value(self, val):
         return datetime.datetime.now().strftime(DATE_TIME_FORMAT)
 
+    def from_solr(self, val):
+        return _from_solr_date(val, DATE_TIME_FORMAT)
+
 
 class File(BaseField):
     solr_type = 'file'
@@ -10,10 +10,18 @@ list like data types on a Model.
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
+from copy import copy
+
 import six
 
 from .node import Node
-from .lib.utils import un_camel, un_camel_id, lazy_property
+from .lib.utils import un_camel_id, lazy_property
+
+
+class ItemData(dict):
+    """
+    Data of an item that is added with ListNode.add(), as opposed to loaded from DB.
+    """
 
 
 class ListNode(Node):
@@ -46,6 +54,8 @@ class ListNode(Node):
     Notes:
         - Currently we disregard the ordering of ListNode items.
         - "reverse_name" dose not supported on linked models.
+        - Items loaded from DB are kept as raw dicts and instantiated
+          on first access, by their position.
 
     """
 
@@ -61,8 +71,10 @@ class ListNode(Node):
             _is_item=False,
             _from_db=False,
             values=[],
-            node_stack=[],
-            node_dict={},
+            # raw dicts or instances of items
+            _items=[],
+            # linked model key -> position, rebuilt on next lookup when None
+            _key_index={},
         )
         super(ListNode, self).__init__(**kwargs)
         self.setattrs(_data=[])
@@ -81,31 +93,42 @@ class ListNode(Node):
 
     def _load_data(self, data, from_db=False):
         """
-        Stores the data at self._data, actual object creation done at _generate_instances()
+        Stores the data at self._items, actual object creation done at _get_item()
 
         Args:
             data (list): List of dicts.
             from_db (bool): Default False. Is this data coming from DB or not.
         """
-        self._data = data[:]
         self.setattrs(
             values=[],
-            node_stack=[],
-            node_dict={},
+            _data=data,
+            _items=data[:],
+            _key_index=None,
+            _from_db=from_db,
+            _dirty=not from_db,
         )
-        self._from_db = from_db
 
     def _generate_instances(self):
         """
-        ListNode item generator. Will be used internally by __iter__ and __getitem__
+        ListNode item generator. Will be used internally by __iter__
 
         Yields:
             ListNode items (instances)
         """
-        for node in self.node_stack:
-            yield node
-        while self._data:
-            yield self._make_instance(self._data.pop(0))
+        position = 0
+        while position < len(self._items):
+            yield self._get_item(position)
+            position += 1
+
+    def _get_item(self, position):
+        """
+        Returns the item at given position, instantiates it if it's not instantiated yet.
+        """
+        item = self._items[position]
+        if isinstance(item, dict):
+            item = self._make_instance(item)
+            self._items[position] = item
+        return item
 
     def _make_instance(self, node_data):
         """
@@ -116,19 +139,70 @@ class ListNode(Node):
         Returns:
             ListNode item.
         """
-        node_data['from_db'] = self._from_db
-        clone = self.__call__(**node_data)
-        clone.setattrs(container = self,
-                    _is_item = True)
-        for name in self._nodes:
-            _name = un_camel(name)
+        from_db = self._from_db and not isinstance(node_data, ItemData)
+        clone = self.__class__(**dict(node_data, from_db=from_db, _root_node=self._root_node))
+        clone.setattrs(container=self,
+                       _is_item=True)
+        for name, _, _name in clone._get_layout().nodes:
             if _name in node_data:  # check for partial data
-                getattr(clone, name)._load_data(node_data[_name])
-        _key = clone._get_linked_model_key()
-        if _key:
-            self.node_dict[_key] = clone
+                getattr(clone, name)._load_data(node_data[_name], from_db)
+        clone.setattrs(_data=node_data,
+                       _dirty=not from_db,
+                       _changed=set())
+        clone.pre_add()
+        return clone
+
+    def _new_item(self, **kwargs):
+        kwargs['_root_node'] = self._root_node
+        clone = self.__class__(**kwargs)
+        clone.setattrs(container=self,
+                       _is_item=True)
+        clone.pre_add()
         return clone
 
+    def _link_data_key(self):
+        # key of the linked model that represents an item, in its data
+        links = self.get_links()
+        return un_camel_id(links[0]['field']) if links else None
+
+    def _item_key(self, item, data_key=None):
+        if isinstance(item, dict):
+            return item.get(data_key) if data_key else None
+        return item._get_linked_model_key()
+
+    def _get_key_index(self):
+        """
+        Returns:
+            Dict of linked model keys to positions of items.
+        """
+        if self._key_index is None:
+            data_key = self._link_data_key()
+            key_index = {}
+            for position, item in enumerate(self._items):
+                key = self._item_key(item, data_key)
+                if key:
+                    key_index[key] = position
+            self.setattrs(_key_index=key_index)
+        return self._key_index
+
+    def _append(self, item):
+        self._set_dirty()
+        self._items.append(item)
+        if self._key_index is not None:
+            key = self._item_key(item, self._link_data_key())
+            if key:
+                self._key_index[key] = len(self._items) - 1
+
+    def _position_of(self, item):
+        for position, _item in enumerate(self._items):
+            if _item is item:
+                return position
+        raise ValueError("%r is not in the list" % item)
+
+    def _remove_position(self, position):
+        del self._items[position]
+        self.setattrs(_key_index=None, _dirty=True)
+
     def _get_linked_model_key(self):
         """
         Only one linked model can represent a listnode instance,
@@ -148,10 +222,38 @@ class ListNode(Node):
             List of dicts.
         """
         result = []
-        for mdl in self:
-            result.append(super(ListNode, mdl).clean_value())
+        for position, item in enumerate(self._items):
+            if isinstance(item, dict) and self._from_db and not isinstance(item, ItemData):
+                # not even instantiated since loaded
+                result.append(item)
+                continue
+            item = self._get_item(position)
+            result.append(super(ListNode, item).clean_value() if item._is_dirty()
+                          else copy(item._data))
         return result
 
+    def _set_all_dirty(self):
+        if self._is_item:
+            return super(ListNode, self)._set_all_dirty()
+        self.setattrs(_dirty=True)
+        # items that are not instantiated are serialized as they're loaded
+        for position in range(len(self._items)):
+            self._get_item(position)._set_all_dirty()
+
+    def _set_clean(self, data):
+        if self._is_item:
+            return super(ListNode, self)._set_clean(data)
+        self.setattrs(_data=data, _dirty=len(data) != len(self._items), _changed=set())
+        for item, item_data in zip(self._items, data):
+            if not isinstance(item, dict):
+                item._set_clean(item_data)
+
+    def _is_dirty(self):
+        if self._is_item:
+            return super(ListNode, self)._is_dirty()
+        return self._dirty or any(not isinstance(item, dict) and item._is_dirty()
+                                  for item in self._items)
+
     def __repr__(self):
         """
         This works for two different object:
@@ -183,7 +285,7 @@ class ListNode(Node):
         Args:
             kwargs: attributes of the ListNode
         """
-        self._data.append(kwargs)
+        self._append(ItemData(kwargs))
 
     def pre_add(self):
         """
@@ -195,14 +297,8 @@ class ListNode(Node):
         """
         Stores created instance in node_stack and returns it's reference to callee
         """
-        kwargs['_root_node'] = self._root_node
-        clone = self.__class__(**kwargs)
-        clone.setattrs(_is_item = True)
-        clone.pre_add()
-        self.node_stack.append(clone)
-        _key = clone._get_linked_model_key()
-        if _key:
-            self.node_dict[_key] = clone
+        clone = self._new_item(**kwargs)
+        self._append(clone)
         return clone
 
     def clear(self):
@@ -214,21 +310,18 @@ class ListNode(Node):
         """
         if self._is_item:
             raise TypeError("This an item of the parent ListNode")
-        self.node_stack = []
-        self._data = []
+        self.setattrs(_items=[], _key_index={}, _dirty=True)
 
     def __contains__(self, item):
-        if self._data:
-            return any([d[un_camel_id(item.__class__.__name__)] == item.key for d in self._data])
-        else:
-            return item.key in self.node_dict
+        return item.key in self._get_key_index()
 
     def __len__(self):
-        # FIXME: Partial evolution of ListNode iterator can cause incorrect results
-        return len(self._data or self.node_stack)
+        return len(self._items)
 
     def __getitem__(self, index):
-        return list(self._generate_instances()).__getitem__(index)
+        if isinstance(index, slice):
+            return [self._get_item(i) for i in range(*index.indices(len(self._items)))]
+        return self._get_item(index)
 
     def __iter__(self):
         return self._generate_instances()
@@ -237,7 +330,8 @@ class ListNode(Node):
         # This is not useful in current state. Should be refactored or removed.
         if self._is_item:
             raise TypeError("This an item of the parent ListNode")
-        self.node_stack[key] = value
+        self._items[key] = value
+        self.setattrs(_key_index=None, _dirty=True)
 
     def __delitem__(self, obj, sync=True):
         """
@@ -251,18 +345,17 @@ class ListNode(Node):
         """
         if self._is_item:
             raise TypeError("This an item of the parent ListNode")
-        list(self._generate_instances())
         _lnk_key = None
         if isinstance(obj, six.string_types):
             _lnk_key = obj
-            _obj = self.node_dict[obj]
+            position = self._get_key_index()[obj]
         elif not isinstance(obj, self.__class__):
             _lnk_key = obj.key
-            _obj = self.node_dict[obj.key]
-            del self.node_dict[obj.key]
+            position = self._get_key_index()[obj.key]
         else:
-            _obj = obj
-        self.node_stack.remove(_obj)
+            position = self._position_of(obj)
+        _obj = self._get_item(position)
+        self._remove_position(position)
         if _lnk_key and sync:
             # this is a "many_to_n" relationship,
             # we should cleanup other side too.
@@ -286,4 +379,4 @@ class ListNode(Node):
         """
         if not self._is_item:
             raise TypeError("Should be called on an item, not ListNode's itself.")
-        self.container.node_stack.remove(self)
+        self.container._remove_position(self.container._position_of(self))
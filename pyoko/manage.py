@@ -19,7 +19,6 @@ import time
 from os import environ
 import os
 import sys
-from riak import ConflictError
 
 from pyoko.conf import settings
 from riak.client import binary_json_decoder, binary_json_encoder
@@ -125,7 +124,10 @@ class SchemaUpdate(Command):
     CMD_NAME = 'migrate'
     PARAMS = [{'name': 'model', 'required': True, 'help': 'Models name(s) to be updated.'
                                                           ' Say "all" to update all models'},
-              {'name': 'threads', 'default': 1, 'help': 'Max number of threads. Defaults to 1'},
+              {'name': 'threads', 'default': 1,
+               'help': 'Max number of models to migrate in parallel. Defaults to 1'},
+              {'name': 'workers', 'type': int, 'default': 8,
+               'help': 'Number of threads to re-store objects of a model. Defaults to 8'},
               {'name': 'force', 'action': 'store_true', 'help': 'Force schema creation'},
               ]
     HELP = 'Creates/Updates SOLR schemas for given model(s)'
@@ -140,6 +142,7 @@ class SchemaUpdate(Command):
                                 self.manager.args.model,
                                 self.manager.args.threads,
                                 self.manager.args.force,
+                                self.manager.args.workers,
                                 )
         updater.run()
         return updater.create_report()
@@ -188,12 +191,24 @@ class ReIndex(Command):
     PARAMS = [{'name': 'model', 'required': True,
                'help': 'Models name(s) to be cleared. Say "all" to clear all models'},
               {'name': 'exclude',
-               'help': 'Models name(s) to be excluded, comma separated'}
+               'help': 'Models name(s) to be excluded, comma separated'},
+              {'name': 'workers', 'type': int, 'default': 8,
+               'help': 'Number of threads to store objects. Defaults to 8'},
+              {'name': 'raw', 'action': 'store_true',
+               'help': 'Store objects as is, without loading them into models'},
+              {'name': 'rate', 'type': float,
+               'help': 'Max number of objects to store per second'},
+              {'name': 'checkpoint',
+               'help': 'Checkpoint file to resume an interrupted re-index from'},
+              {'name': 'chunk_size', 'type': int,
+               'help': 'Number of keys to fetch at once. '
+                       'Defaults to settings.MULTIGET_CHUNK_SIZE'},
               ]
 
     def run(self):
         from pyoko.conf import settings
         from importlib import import_module
+        from pyoko.db.reindex import Reindexer
         import_module(settings.MODELS_MODULE)
         registry = import_module('pyoko.model').model_registry
         model_name = self.manager.args.model
@@ -206,32 +221,15 @@ class ReIndex(Command):
                                    self.manager.args.exclude.split(',')]
                 models = [model for model in models if model not in excluded_models]
 
-        for mdl in models:
-            stream = mdl.objects.adapter.bucket.stream_keys()
-            i = 0
-            unsaved_keys = []
-            for key_list in stream:
-                for key in key_list:
-                    i += 1
-                    # time.sleep(0.4)
-                    try:
-                        mdl.objects.get(key).save()
-                        # obj = mdl.bucket.get(key)
-                        # if obj.data:
-                        #     obj.store()
-                    except ConflictError:
-                        unsaved_keys.append(key)
-                        print("Error on save. Record in conflict: %s > %s" % (mdl.__name__, key))
-                    except:
-                        unsaved_keys.append(key)
-                        print("Error on save! %s > %s" % (mdl.__name__, key))
-                        import traceback
-
-                        traceback.print_exc()
-            stream.close()
-            print("Re-indexed %s records of %s" % (i, mdl.__name__))
-            if unsaved_keys:
-                print("\nThese keys cannot be updated:\n\n", unsaved_keys)
+        failed = Reindexer(models,
+                           workers=self.manager.args.workers,
+                           raw=self.manager.args.raw,
+                           rate=self.manager.args.rate,
+                           checkpoint_path=self.manager.args.checkpoint,
+                           chunk_size=self.manager.args.chunk_size).run()
+        for model_name, keys in failed.items():
+            if keys:
+                print("\nThese keys of %s cannot be updated:\n\n" % model_name, keys)
 
 
 class SmartFormatter(HelpFormatter):
@@ -355,32 +353,16 @@ class BaseDumpHandler(object):
                 print('Dumping {model}'.format(model=mdl.__name__))
 
             model = mdl(super_context)
-            count = model.objects.count()
-            rounds = int(count / self._batch_size) + 1
             bucket = model.objects.adapter.bucket
 
             self.pre_dump_hook(bucket)
-            for i in range(rounds):
-
-                start = 0 if self._remove_dumped else i
-
-                data = model.objects.data().raw('*:*').set_params(
-                    sort="timestamp asc",
-                    rows=self._batch_size,
-                    start=start * self._batch_size,
-                )
-
-                try:
-                    for value, key in data:
-                        if value is not None:
-                            self.handle_data(bucket, key, value)
-                            self.post_handle_data_hook(bucket, key, value)
-                    if self._remove_dumped:
-                        # wait 1 second to pass for next round
-                        print("removed dumped objects from riak, waiting for solr sync")
-                        time.sleep(5)
-                except ValueError:
-                    raise
+            # pages are selected by key, so removing dumped objects
+            # doesn't shift the following pages
+            data = model.objects.data().raw('*:*')
+            for value, key in data.iterator(self._batch_size):
+                if value is not None:
+                    self.handle_data(bucket, key, value)
+                    self.post_handle_data_hook(bucket, key, value)
             self.post_dump_hook(bucket)
 
     def write(self, data):
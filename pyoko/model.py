@@ -10,12 +10,13 @@ This module holds the pyoko's Model object
 import six
 import time
 
-from pyoko.exceptions import IntegrityError, ObjectDoesNotExist
+from pyoko.exceptions import ObjectDoesNotExist
 from .node import Node, FakeContext
 from . import fields as field
 from .db.queryset import QuerySet
+from .db.adapter.db_riak import IndexWaiter
+from .db.uniqueness import UniquenessChecker
 from .lib.utils import un_camel, lazy_property, pprnt, un_camel_id
-import weakref
 
 super_context = FakeContext()
 
@@ -78,6 +79,8 @@ class Model(Node):
             just_created=None,
             on_save=[],
             _exists=None,
+            _vclock=None,
+            _data_is_stored=False,
         )
         # self.verbose_name = kwargs.get('verbose_name')
         # self.null = kwargs.get('null', False)
@@ -99,7 +102,7 @@ class Model(Node):
 
         self.objects.set_model(model=self)
         self.setattrs(objects=self.row_level_access(self._context, self.objects))
-        self._instance_registry.add(weakref.ref(self))
+        self._instance_registry[id(self)] = self
         # self.saved_models = []
 
     def __str__(self):
@@ -195,6 +198,12 @@ class Model(Node):
         self._load_data(data, from_db)
         return self
 
+    def _load_data(self, data, from_db=False):
+        super(Model, self)._load_data(data, from_db)
+        # tells whether _data is what's stored in DB, see Adapter._is_unchanged()
+        self.setattr('_data_is_stored', from_db)
+        return self
+
     def __repr__(self):
         if not self.is_in_db():
             return six.text_type(self.__class__)
@@ -386,30 +395,12 @@ class Model(Node):
 
     def _handle_uniqueness(self):
         """
+        Checks unique and unique_together constraints with one query.
 
         Raises:
             IntegrityError if unique and unique_together checks does not pass
         """
-
-        def _getattr(u):
-            try:
-                return self._field_values[u]
-            except KeyError:
-                return getattr(self, u)
-
-        if self._uniques:
-            for u in self._uniques:
-                val = _getattr(u)
-                if val and self.objects.filter(**{u: val}).count():
-                    raise IntegrityError("Unique mismatch: %s for %s already exists for value: %s" %
-                                         (u, self.__class__.__name__, val))
-        if self.Meta.unique_together:
-            for uniques in self.Meta.unique_together:
-                vals = dict([(u, _getattr(u)) for u in uniques])
-                if self.objects.filter(**vals).count():
-                    raise IntegrityError(
-                        "Unique together mismatch: %s combination already exists for %s"
-                        % (vals, self.__class__.__name__))
+        UniquenessChecker(self.objects).check(self)
 
     def save(self, internal=False, meta=None, index_fields=None):
         """
@@ -456,22 +447,41 @@ class Model(Node):
         self._post_save_hook_called = False
         return self
 
-    def changed_fields(self):
+    def _get_changed_values(self):
         """
-        Returns:
-            list: List of fields names which their values changed.
+        Serializes only the fields, links and nodes which are
+        assigned or modified since the model is loaded or saved.
+
+        Yields:
+            (data key, serialized value) tuples.
         """
-        current_dict = self.clean_value()
-        # `from_db` attr is set False as default, when a `ListNode` is
-        # initialized just after above `clean_value` is called. `from_db` flags
-        # in 'list node sets' makes differences between clean_data and object._data.
+        layout = self._get_layout()
+        for name, field_ins, _name in layout.fields:
+            if name in self._changed:
+                path_name = self._path_of(name)
+                if path_name in self._secured_data:
+                    yield _name, self._secured_data[path_name]
+                else:
+                    yield _name, field_ins.clean_value(self._field_values.get(name))
+        for lnk, field_id, mdl_id in layout.links:
+            if lnk['field'] in self._changed or field_id in self._changed:
+                lnkd_mdl = getattr(self, lnk['field'])
+                yield mdl_id, getattr(self, mdl_id) or (lnkd_mdl.key if lnkd_mdl is not None else '')
+        for name, _, _name in layout.nodes:
+            node = getattr(self, name)
+            if node._is_dirty():
+                yield _name, node.clean_value()
 
-        # Thus, after clean_value, object's data is taken from db again.
-        db_data = self.objects.data().filter(key=self.key)[0][0]
+    def changed_fields(self):
+        """
+        Compares changed values with the data the model is loaded from
+        or saved with, without querying the DB.
 
-        set_current, set_past = set(current_dict.keys()), set(db_data.keys())
-        intersect = set_current.intersection(set_past)
-        return set(o for o in intersect if db_data[o] != current_dict[o])
+        Returns:
+            set: Set of fields names which their values changed.
+        """
+        return set(key for key, value in self._get_changed_values()
+                   if key in self._data and self._data[key] != value)
 
     def is_changed(self, field):
         """
@@ -498,8 +508,7 @@ class Model(Node):
             self.setattr(query, query_dict[query])
 
         self.save()
-        while not self.objects.filter(key=self.key, **query_dict).count():
-            time.sleep(0.3)
+        IndexWaiter(self.objects, [self.key], query_dict).wait()
         return self
 
     def blocking_delete(self):
@@ -507,8 +516,7 @@ class Model(Node):
         Deletes and waits till the backend properly update indexes for just deleted object.
         """
         self.delete()
-        while self.objects.filter(key=self.key).count():
-            time.sleep(0.3)
+        IndexWaiter(self.objects, [self.key], deleted=True).wait()
 
     def _traverse_relations(self):
         for lnk in self.get_links(link_source=False):
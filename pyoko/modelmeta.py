@@ -7,17 +7,55 @@
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
 import pprint
+import weakref
 from collections import defaultdict
 
 from pyoko.conf import settings
 from pyoko.db.queryset import QuerySet
-from pyoko.lib.utils import un_camel
+from pyoko.lib.utils import un_camel, un_camel_id, get_object_from_path
 from pyoko.registry import Registry
 from . import fields as field
 
 model_registry = Registry()
 
 
+class ModelLayout(object):
+    """
+    Precomputed structure of a node class, shared by all of its instances.
+
+    Built on first instantiation of the class and dropped
+    when links or nodes of the class are modified.
+
+    Attributes:
+        name (str): un_camel'ed class name, used in node paths.
+        fields (list): (name, field, un_camel'ed name) tuples, in definition order.
+        choice_fields (tuple): Names of fields which have choices.
+        timestamp_fields (frozenset): Data keys of TimeStamp fields, which are
+            set on each serialization.
+        links (list): (link, attribute name of key, data key) tuples of
+            links which are not sets.
+        set_links (list): Links which are sets.
+        nodes (list): (name, node class, un_camel'ed name) tuples.
+        choices_manager: Object of ``settings.CATALOG_DATA_MANAGER``.
+        record_class: Record class of the model, see pyoko.record.get_record_class()
+    """
+
+    def __init__(self, kls):
+        self.name = un_camel(kls.__name__)
+        self.fields = [(name, fld, un_camel(name)) for name, fld in
+                       sorted(kls._fields.items(), key=lambda kv: kv[1]._order)]
+        self.choice_fields = tuple(name for name, fld, _ in self.fields
+                                   if fld.choices is not None)
+        self.timestamp_fields = frozenset(data_key for _, fld, data_key in self.fields
+                                          if isinstance(fld, field.TimeStamp))
+        self.links = [(lnk, lnk['field'] + '_id', un_camel_id(lnk['field']))
+                      for lnk in kls.get_links(is_set=False)]
+        self.set_links = kls.get_links(is_set=True)
+        self.nodes = [(name, klass, un_camel(name)) for name, klass in kls._nodes.items()]
+        self.choices_manager = get_object_from_path(settings.CATALOG_DATA_MANAGER)
+        self.record_class = None
+
+
 class ModelMeta(type):
     """
     Metaclass that process model classes.
@@ -61,6 +99,10 @@ class ModelMeta(type):
         attrs['_lazy_linked_models'] = defaultdict(list)
         attrs['_fields'] = {}
         attrs['_uniques'] = []
+        # built on first instantiation, see Node._get_layout()
+        attrs['_layout'] = None
+        # cached get_links() results, see Node.get_links()
+        attrs['_links_index'] = {}
         # attrs['_many_to_models'] = []
 
         # iterating over attributes of the soon to be created class object.
@@ -116,7 +158,8 @@ class ModelMeta(type):
         Attach default fields and meta options to models
         """
         attrs.update(base_model_class._DEFAULT_BASE_FIELDS)
-        attrs['_instance_registry'] = set()
+        # keyed by id(), as hash of a model depends on its data
+        attrs['_instance_registry'] = weakref.WeakValueDictionary()
         attrs['_is_unpermitted_fields_set'] = False
         attrs['save_meta_data'] = None
         attrs['_pre_save_hook_called'] = False
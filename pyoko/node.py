@@ -21,12 +21,15 @@ from collections import defaultdict
 
 from pyoko.exceptions import ObjectDoesNotExist, ValidationError, MultipleObjectsReturned
 from .conf import settings
-from .lib.utils import get_object_from_path, lazy_property, un_camel, un_camel_id
-from .modelmeta import ModelMeta
+from .lib.utils import lazy_property, un_camel, un_camel_id
+from .modelmeta import ModelMeta, ModelLayout
 
 SOLR_SUPPORTED_TYPES = ['string', 'text_general', 'float', 'int', 'boolean',
                         'date', 'long', 'text_tr']
 
+#: link keys that get_links() lookups are cached by
+INDEXED_LINK_KEYS = frozenset(['is_set', 'link_source', 'field', 'mdl'])
+
 
 class LazyModel(lazy_object_proxy.Proxy):
     key = None
@@ -77,7 +80,13 @@ class Node(object):
     _is_auto_created = False
 
     def setattr(self, key, val):
+        """
+        Sets the attribute without the checks of __setattr__.
+        Public attributes are still recorded as changed.
+        """
         object.__setattr__(self, key, val)
+        if not key.startswith('_'):
+            self._set_dirty(key)
 
     def setattrs(self, **kwargs):
         self.__dict__.update(kwargs)
@@ -107,21 +116,68 @@ class Node(object):
                                        _attr.__class__.__name__,
                                        getattr(_attr, '_TYPE', None)))
         object.__setattr__(self, key, val)
+        if not key.startswith('_'):
+            # eg: linked models and their keys
+            self._set_dirty(key)
+
+    def _set_dirty(self, name=None):
+        """
+        Marks the node as changed, so it will be serialized on save
+        instead of reusing the data it's loaded from.
+
+        Args:
+            name (str): Name of the assigned field or attribute.
+        """
+        self.__dict__['_dirty'] = True
+        if name is not None:
+            self._changed.add(name)
+
+    def _set_all_dirty(self):
+        """
+        Marks the node and its sub nodes as changed, so they're serialized
+        with their current definitions instead of reusing the loaded data.
+        """
+        self.__dict__['_dirty'] = True
+        for name, _, _ in self._get_layout().nodes:
+            getattr(self, name)._set_all_dirty()
+
+    def _set_clean(self, data):
+        """
+        Marks the node and its sub nodes as unchanged,
+        with the data they're serialized to.
+
+        Args:
+            data (dict): Serialized data of the node.
+        """
+        self.setattrs(_data=data, _dirty=False, _changed=set())
+        for name, _, _name in self._get_layout().nodes:
+            if _name in data:
+                getattr(self, name)._set_clean(data[_name])
+
+    def _is_dirty(self):
+        """
+        Returns:
+            True if the node or any of its sub nodes changed since they're loaded from DB.
+        """
+        return self._dirty or any(getattr(self, name)._is_dirty()
+                                  for name, _, _ in self._get_layout().nodes)
 
     def __init__(self, **kwargs):
+        layout = self._get_layout()
         self.setattrs(
             _node_path=[],
             _field_values={},
             _secured_data={},
-            _choice_fields=[],
+            _choice_fields=layout.choice_fields,
             _data={},
-            _choices_manager=get_object_from_path(settings.CATALOG_DATA_MANAGER),
+            _choices_manager=layout.choices_manager,
+            _dirty=True,
+            # names of fields and attributes assigned since loaded
+            _changed=set(),
 
         )
         super(Node, self).__init__()
-        try:
-            self._root_node
-        except:
+        if '_root_node' not in self.__dict__:
             self.setattrs(
                 _root_node=kwargs.pop('_root_node', None),
                 _context=kwargs.pop('context', None),
@@ -153,7 +209,19 @@ class Node(object):
 
     @lazy_property
     def _ordered_fields(self):
-        return sorted(self._fields.items(), key=lambda kv: kv[1]._order)
+        return [(name, fld) for name, fld, _ in self._get_layout().fields]
+
+    @classmethod
+    def _get_layout(cls):
+        """
+        Returns:
+            ModelLayout of the class, builds it if not built yet or invalidated.
+        """
+        layout = cls.__dict__.get('_layout')
+        if layout is None:
+            layout = ModelLayout(cls)
+            cls._layout = layout
+        return layout
 
     @classmethod
     def _add_linked_model(cls, mdl, link_source=False, null=False, o2o=False, field=None,
@@ -178,6 +246,8 @@ class Node(object):
         cls._debug_linked_models[mdl.__name__].append(debug_lnk)
         if lnk not in cls._linked_models[mdl.__name__]:
             cls._linked_models[mdl.__name__].append(lnk)
+            cls._layout = None
+            cls._links_index = {}
 
     @classmethod
     def _get_bucket_name(cls):
@@ -188,7 +258,7 @@ class Node(object):
         returns the dotted path of the given model attribute
         """
         root_name = (self._root_node or self)._get_bucket_name()
-        return ('.'.join(list(self._node_path + [un_camel(self.__class__.__name__),
+        return ('.'.join(list(self._node_path + [self._get_layout().name,
                                                  prop]))).replace('%s.' % root_name, '')
 
     @classmethod
@@ -213,6 +283,9 @@ class Node(object):
         """
         Linked models from this model
 
+        Lookups which only filter on keys of INDEXED_LINK_KEYS are
+        cached per class, till links of the class modified by _add_linked_model().
+
         Keyword Args:
             filter by items of _linked_models
 
@@ -220,16 +293,27 @@ class Node(object):
                 Only works for filtering over one field.
 
         Returns:
-            Link list
+            Link list. Should not be modified by the caller.
         """
         # TODO: Add tests for this method
         startswith = kw.pop('startswith', False)
+        if startswith or not INDEXED_LINK_KEYS.issuperset(kw):
+            return cls._filter_links(kw, startswith)
+        index_key = tuple(sorted(kw.items()))
+        try:
+            return cls._links_index[index_key]
+        except KeyError:
+            models = cls._filter_links(kw)
+            cls._links_index[index_key] = models
+            return models
+
+    @classmethod
+    def _filter_links(cls, kw, startswith=False):
         kwitems = list(kw.items())  # Dictionary items is not indexible in Python 3
-        constraint = set(kwitems)
         models = []
         for links in cls._linked_models.values():
             for lnk in links:
-                if not constraint or constraint.issubset(set(lnk.items())):
+                if all(k in lnk and lnk[k] == v for k, v in kwitems):
                     models.append(lnk)
                 elif startswith and lnk[kwitems[0][0]].startswith(kwitems[0][1]):
                     models.append(lnk)
@@ -241,10 +325,10 @@ class Node(object):
         def foo_model(modl, context, null, verbose_name):
             return LazyModel(lambda: modl(context), null, verbose_name)
 
-        for lnk in self.get_links(is_set=False):
+        for lnk, field_id, _name in self._get_layout().links:
             # if lnk['is_set']:
             #     continue
-            self.setattr(lnk['field'] + '_id', "")
+            self.setattr(field_id, "")
             if data:
                 # data can be came from db or user
                 if lnk['field'] in data and isinstance(data[lnk['field']], Model):
@@ -262,7 +346,6 @@ class Node(object):
                     except:
                         pass
                 else:
-                    _name = un_camel_id(lnk['field'])
                     if _name in data and data[_name] is not None:
                         # this is coming from db,
                         # we're preparing a lazy model loader
@@ -308,7 +391,7 @@ class Node(object):
         # instantiate given node, pass path and _root_node info
         ins = klass(**{'context': self._context,
                        '_root_node': self._root_node or self})
-        ins.setattr('_node_path', self._node_path + [un_camel(self.__class__.__name__)])
+        ins.setattr('_node_path', self._node_path + [self._get_layout().name])
         self.setattr(name, ins)
         return ins
 
@@ -316,12 +399,11 @@ class Node(object):
         """
         instantiate all nodes
         """
-        for name, klass in self._nodes.items():
+        for name, klass, _ in self._get_layout().nodes:
             self._instantiate_node(name, klass)
 
     def _fill_nodes(self, data):
-        for name in self._nodes:
-            _name = un_camel(name)
+        for name, _, _name in self._get_layout().nodes:
             if _name in self._data:
                 # node = self._instantiate_node(name, getattr(self, name).__class__)
                 node = getattr(self, name)
@@ -373,19 +455,23 @@ class Node(object):
             kwargs: Field values
         """
         # if kwargs:
-        for name, _field in self._fields.items():
+        from_db = kwargs.get('from_db')
+        unpermitted_fields = None
+        for name, _field, _ in self._get_layout().fields:
             val = None
             if name in kwargs:
-                val = kwargs.get(name, self._field_values.get(name))
-                path_name = self._path_of(name)
-                _root_node = self._root_node or self
-                if path_name in _root_node.get_unpermitted_fields():
-                    self._secured_data[path_name] = val
-                    continue
+                val = kwargs[name]
+                if unpermitted_fields is None:
+                    unpermitted_fields = (self._root_node or self).get_unpermitted_fields()
+                if unpermitted_fields:
+                    path_name = self._path_of(name)
+                    if path_name in unpermitted_fields:
+                        self._secured_data[path_name] = val
+                        continue
             elif _field.default:
                 val = _field.default() if callable(_field.default) else _field.default
             if val is not None:
-                if not kwargs.get('from_db'):
+                if not from_db:
                     self.setattr(name, val)
                 else:
                     _field._load_data(self, val)
@@ -393,7 +479,6 @@ class Node(object):
             # if not self._field_values.get(name):
             #     self._field_values[name] = getattr(self, name)
             if _field.choices is not None:
-                self._choice_fields.append(name)
                 self._set_get_choice_display_method(name, _field, val)
 
     def _set_get_choice_display_method(self, name, _field, val):
@@ -451,30 +536,30 @@ class Node(object):
         self._set_fields_values(self._data)
         self._instantiate_linked_models(self._data)
         del self._data['from_db']
+        # unchanged nodes are serialized from the data they're loaded from
+        self.setattrs(_dirty=not from_db, _changed=set())
         return self
 
     def _clean_node_value(self, dct):
         # get values of nodes
-        for name in self._nodes:
+        for name, _, _name in self._get_layout().nodes:
             node = getattr(self, name)
-            dct[un_camel(name)] = node.clean_value()
+            dct[_name] = node.clean_value() if node._is_dirty() else copy(node._data)
         return dct
 
     def _clean_field_value(self, dct):
         # get values of fields
-        for name, field_ins in self._fields.items():
-            path_name = self._path_of(name)
-            if path_name in self._secured_data:
-                dct[un_camel(name)] = self._secured_data[path_name]
+        for name, field_ins, _name in self._get_layout().fields:
+            if self._secured_data and self._path_of(name) in self._secured_data:
+                dct[_name] = self._secured_data[self._path_of(name)]
             else:
-                dct[un_camel(name)] = field_ins.clean_value(self._field_values.get(name))
+                dct[_name] = field_ins.clean_value(self._field_values.get(name))
         return dct
 
     def _clean_linked_model_value(self, dct):
         # get keys of linked models
-        for lnk in self.get_links(is_set=False):
+        for lnk, _, mdl_id in self._get_layout().links:
             lnkd_mdl = getattr(self, lnk['field'])
-            mdl_id = un_camel_id(lnk['field'])
             dct[mdl_id] = getattr(self, mdl_id) or (lnkd_mdl.key if lnkd_mdl is not None else '')
 
     def clean_value(self):
@@ -0,0 +1,160 @@
+# -*-  coding: utf-8 -*-
+"""
+Read-only records, lightweight alternative to model instances
+for reading large result sets.
+
+.. code-block:: python
+
+    for student in Student.objects.filter(deleted=False).records():
+        print(student.name, student.join_date, student.lecturer_id)
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import six
+
+from pyoko.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
+
+
+class Record(object):
+    """
+    Read-only view of the stored data of a model object.
+
+    Fields are converted on first access, linked models are fetched
+    on first access. Nodes and ListNodes are returned as stored,
+    as dict and list of dicts. Fields that are not permitted for
+    the context are read as None.
+
+    Record classes are generated per model class, see get_record_class().
+
+    Args:
+        data (dict): Stored data of the object.
+        key (str): Object key.
+        context: Context to fetch linked models with.
+        hidden (frozenset): Names of fields that are not permitted for the context.
+    """
+    __slots__ = ('key', '_data', '_field_values', '_context', '_hidden')
+    _model_class = None
+
+    def __init__(self, data, key=None, context=None, hidden=frozenset()):
+        object.__setattr__(self, 'key', key)
+        object.__setattr__(self, '_data', data)
+        object.__setattr__(self, '_field_values', {})
+        object.__setattr__(self, '_context', context)
+        object.__setattr__(self, '_hidden', hidden)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("%s is read-only" % self.__class__.__name__)
+
+    def _set_get_choice_display_method(self, name, _field, val):
+        # called by fields while loading data
+        pass
+
+    def _set_dirty(self, name=None):
+        pass
+
+    def to_model(self):
+        """
+        Returns:
+            Model instance of the record.
+        """
+        model = self._model_class(self._context)
+        model.setattr('key', self.key)
+        return model.set_data(self._data, from_db=True)
+
+    def __repr__(self):
+        return six.text_type('<%s: %s>' % (self.__class__.__name__, self.key))
+
+
+def _field_property(name, _field, data_name):
+    def getter(self):
+        try:
+            return self._field_values[name]
+        except KeyError:
+            val = None
+            if data_name in self._data:
+                if name not in self._hidden:
+                    val = self._data[data_name]
+            elif _field.default:
+                val = _field.default() if callable(_field.default) else _field.default
+            if val is not None:
+                _field._load_data(self, val)
+            else:
+                self._field_values[name] = None
+            return self._field_values[name]
+
+    return property(getter)
+
+
+def _get_linked_model(lnk, key, context):
+    try:
+        return lnk['mdl'](context).objects.get(key)
+    except (ObjectDoesNotExist, MultipleObjectsReturned):
+        # same as lazy linked models of model instances, see GH-46
+        missing_object = lnk['mdl'](context, null=lnk['null'], verbose_name=lnk['verbose'])
+        missing_object._exists = False
+        return missing_object
+
+
+def _link_property(lnk, data_name):
+    field_name = lnk['field']
+
+    def getter(self):
+        try:
+            return self._field_values[field_name]
+        except KeyError:
+            key = self._data.get(data_name)
+            linked_model = _get_linked_model(lnk, key, self._context) if key else None
+            self._field_values[field_name] = linked_model
+            return linked_model
+
+    return property(getter)
+
+
+def _data_property(data_name):
+    return property(lambda self: self._data.get(data_name))
+
+
+def get_record_class(model_class):
+    """
+    Returns the record class of given model class,
+    generates it if not generated yet or links of the model modified.
+
+    Args:
+        model_class: Model class.
+
+    Returns:
+        Record subclass.
+    """
+    layout = model_class._get_layout()
+    if layout.record_class is None:
+        attrs = {'__slots__': (), '_model_class': model_class}
+        for name, _field, data_name in layout.fields:
+            attrs[name] = _field_property(name, _field, data_name)
+        for lnk, field_id, data_name in layout.links:
+            attrs[lnk['field']] = _link_property(lnk, data_name)
+            attrs[field_id] = _data_property(data_name)
+        for name, _, data_name in layout.nodes:
+            attrs[name] = _data_property(data_name)
+        layout.record_class = type('%sRecord' % model_class.__name__, (Record,), attrs)
+    return layout.record_class
+
+
+def get_hidden_fields(model_class, context):
+    """
+    Args:
+        model_class: Model class.
+        context: Current context.
+
+    Returns:
+        Frozenset of field names which are not permitted for the context.
+    """
+    if context is None:
+        return frozenset()
+    hidden = []
+    for perm, fields in model_class.Meta.field_permissions.items():
+        if not context.has_permission(perm):
+            hidden.extend(fields)
+    return frozenset(hidden)
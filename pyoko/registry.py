@@ -136,10 +136,9 @@ class Registry(object):
     def _create_one_to_one(self, source_mdl, target_mdl, field_name):
         mdl_instance = source_mdl(one_to_one=True)
         mdl_instance.setattrs(_is_auto_created = True)
-        for instance_ref in target_mdl._instance_registry:
-            mdl = instance_ref()
-            if mdl:  # if not yet garbage collected
-                mdl.setattr(field_name, mdl_instance)
+        # garbage collected instances are dropped from the registry
+        for mdl in list(target_mdl._instance_registry.values()):
+            mdl.setattr(field_name, mdl_instance)
                 # target_mdl._add_linked_model(source_mdl, o2o=True, field=field_name)
 
     def _create_one_to_many(self, source_mdl, target_mdl, listnode_name=None, verbose_name=None):
@@ -158,12 +157,11 @@ class Registry(object):
         #                            reverse=un_camel(source_mdl.__name__), offff=target_mdl)
         # source_mdl._add_linked_model(target_mdl, o2o=False, )
         target_mdl._nodes[listnode_name] = listnode
+        target_mdl._layout = None
         # add just created model_set to model instances that
         # initialized inside of another model as linked model
-        for instance_ref in target_mdl._instance_registry:
-            mdl = instance_ref()
-            if mdl:  # if not yet garbage collected
-                mdl._instantiate_node(listnode_name, listnode)
+        for mdl in list(target_mdl._instance_registry.values()):
+            mdl._instantiate_node(listnode_name, listnode)
 
     def get_base_models(self):
         return self.registry.values()
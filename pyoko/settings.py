@@ -14,8 +14,27 @@ DEFAULT_BUCKET_TYPE = os.environ.get('DEFAULT_BUCKET_TYPE', 'pyoko_models')
 VERSION_LOG_BUCKET_TYPE = os.environ.get('VERSION_LOG_BUCKET_TYPE', 'log_version')
 
 RIAK_SERVER = os.environ.get('RIAK_SERVER', 'localhost')
+#: "http" or "pbc" (protocol buffers)
 RIAK_PROTOCOL = os.environ.get('RIAK_PROTOCOL', 'http')
 RIAK_PORT = os.environ.get('RIAK_PORT', 8098)
+RIAK_PB_PORT = os.environ.get('RIAK_PB_PORT', 8087)
+
+#: Comma separated list of Riak nodes as host[:http_port[:pb_port]],
+#: requests are distributed to healthy nodes in round robin order.
+#: Defaults to RIAK_SERVER.
+RIAK_NODES = os.environ.get('RIAK_NODES', '')
+
+#: Nodes with a higher error rate than this are skipped till their
+#: error rate decays.
+RIAK_NODE_ERROR_RATE = float(os.environ.get('RIAK_NODE_ERROR_RATE', 0.1))
+
+#: Max number of connections in each Riak connection pool of a process.
+#: Zero means unlimited.
+RIAK_MAX_CONNECTIONS = int(os.environ.get('RIAK_MAX_CONNECTIONS', 100))
+
+#: Number of threads of riak client's multiget pool, which is kept for the
+#: life of the client. Zero makes the client start a new pool on each multiget.
+RIAK_MULTIGET_POOL_SIZE = int(os.environ.get('RIAK_MULTIGET_POOL_SIZE', 8))
 
 #: Redis address and port.
 REDIS_SERVER = os.environ.get('REDIS_SERVER', '127.0.0.1:6379')
@@ -23,6 +42,9 @@ REDIS_SERVER = os.environ.get('REDIS_SERVER', '127.0.0.1:6379')
 #: Redis password (password).
 REDIS_PASSWORD = os.environ.get('REDIS_PASSWORD', None)
 
+#: Max number of connections in Redis connection pool of a process.
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 100))
+
 #: Set True to enable versioning on write-once buckets
 ENABLE_VERSIONS = os.environ.get('ENABLE_VERSIONS', 'False') == 'True'
 
@@ -40,5 +62,66 @@ VERSION_BUCKET = os.environ.get('VERSION_BUCKET', 'version')
 #: Set True to enable caching all models to Redis
 ENABLE_CACHING = os.environ.get('ENABLE_CACHING', 'False') == 'True'
 
-#: Set True to enable caching all models to Redis
+#: Expire duration of cached models in seconds
 CACHE_EXPIRE_DURATION = os.environ.get('CACHE_EXPIRE_DURATION', 36000)
+
+#: Max number of Riak gets to run in parallel while fetching objects.
+RIAK_FETCH_CONCURRENCY = int(os.environ.get('RIAK_FETCH_CONCURRENCY', 8))
+
+#: Number of keys to fetch from Riak at once
+#: while iterating over query results.
+MULTIGET_CHUNK_SIZE = int(os.environ.get('MULTIGET_CHUNK_SIZE', 100))
+
+#: Set True to flush cache writes from a background thread
+#: instead of the thread that saves the model.
+CACHE_WRITE_BACKGROUND = os.environ.get('CACHE_WRITE_BACKGROUND', 'False') == 'True'
+
+#: Max number of cache writes to buffer in a save burst before
+#: flushing them to Redis in one pipeline.
+CACHE_WRITE_BATCH_SIZE = int(os.environ.get('CACHE_WRITE_BATCH_SIZE', 100))
+
+#: Max number of threads to store objects in parallel on bulk saves.
+BULK_SAVE_CONCURRENCY = int(os.environ.get('BULK_SAVE_CONCURRENCY', 8))
+
+#: Saves of objects whose serialized data is same with the data they're
+#: loaded with are skipped, along with their version and log writes.
+#: Set False to store them anyway.
+SKIP_UNCHANGED_SAVES = os.environ.get('SKIP_UNCHANGED_SAVES', 'True') == 'True'
+
+#: Max number of unique and unique_together constraints to check
+#: with one Solr query on bulk saves.
+UNIQUENESS_CHECK_CHUNK_SIZE = int(os.environ.get('UNIQUENESS_CHECK_CHUNK_SIZE', 100))
+
+#: Number of threads that run blocking DB calls of asyncio querysets.
+ASYNC_DB_THREADS = int(os.environ.get('ASYNC_DB_THREADS', 32))
+
+#: Max seconds to wait for saved objects to be reflected to Solr
+#: in blocking saves/deletes.
+INDEX_WAIT_TIMEOUT = float(os.environ.get('INDEX_WAIT_TIMEOUT', 60))
+
+#: First and max polling intervals of index waits. Interval is doubled
+#: after each poll.
+INDEX_WAIT_MIN_DELAY = float(os.environ.get('INDEX_WAIT_MIN_DELAY', 0.05))
+INDEX_WAIT_MAX_DELAY = float(os.environ.get('INDEX_WAIT_MAX_DELAY', 1))
+
+#: Number of events to keep in instrumentation ring buffers
+#: and of keys to keep per model in sys.PYOKO_LOGS.
+INSTRUMENTATION_BUFFER_SIZE = int(os.environ.get('INSTRUMENTATION_BUFFER_SIZE', 1000))
+
+#: Max number of compiled query plans to cache. Plans are cached per
+#: query shape; keys, modifiers and value types of the filters.
+QUERY_PLAN_CACHE_SIZE = int(os.environ.get('QUERY_PLAN_CACHE_SIZE', 1000))
+
+#: Max number of key chunks to fetch in parallel in scans.
+SCAN_CONCURRENCY = int(os.environ.get('SCAN_CONCURRENCY', 4))
+
+#: First and max polling intervals of waits for Solr index creation
+#: and deletion in migrations. Interval is doubled after each poll.
+SCHEMA_WAIT_MIN_DELAY = float(os.environ.get('SCHEMA_WAIT_MIN_DELAY', 0.1))
+SCHEMA_WAIT_MAX_DELAY = float(os.environ.get('SCHEMA_WAIT_MAX_DELAY', 2))
+
+#: Local file to keep fingerprints of applied Solr schemas.
+#: Migrations skip the models whose schema is not changed since
+#: the last migration, without asking to Solr. Set empty to disable.
+SCHEMA_CACHE_FILE = os.environ.get('SCHEMA_CACHE_FILE',
+                                   os.path.join(os.path.expanduser('~'), '.pyoko_schemas.json'))
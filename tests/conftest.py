@@ -0,0 +1,14 @@
+# -*-  coding: utf-8 -*-
+"""
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import sys
+
+collect_ignore = []
+if sys.version_info < (3, 7):
+    # asyncio querysets use Python 3.7+ syntax and APIs
+    collect_ignore.append('test_async_queryset.py')
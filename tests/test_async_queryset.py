@@ -0,0 +1,48 @@
+# -*-  coding: utf-8 -*-
+"""
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import asyncio
+
+from pyoko.db.adapter.db_riak import BlockSave
+from pyoko.manage import FlushDB
+from .models import Student
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class TestCase:
+    cleaned_up = False
+
+    @classmethod
+    def prepare_testbed(cls, reset=False):
+        if (not cls.cleaned_up) or reset:
+            FlushDB(model='Student', wait_sync=True).run()
+            cls.cleaned_up = True
+
+    def test_async_save_get_count(self):
+        self.prepare_testbed()
+        with BlockSave(Student):
+            st = run(Student.objects.aio().save(Student(name='Async', surname='Foo')))
+        assert run(Student.objects.aio().filter(name='Async').count()) == 1
+        db_st = run(Student.objects.aio().get(st.key))
+        assert db_st.surname == 'Foo'
+        assert run(Student.objects.aio().get(name='Async')).key == st.key
+
+    def test_async_iteration(self):
+        self.prepare_testbed()
+        with BlockSave(Student):
+            for i in range(5):
+                Student(name='AsyncIter', number=str(i)).save()
+
+        async def collect():
+            return [st.number async for st in
+                    Student.objects.filter(name='AsyncIter').order_by('number').aio()]
+
+        assert run(collect()) == ['0', '1', '2', '3', '4']
@@ -0,0 +1,169 @@
+# -*-  coding: utf-8 -*-
+"""
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import importlib
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from pyoko import conf
+from pyoko.conf import settings, Settings
+from pyoko.db.connection import ProcessLocal, RiakClient, get_riak_nodes, limit_pool
+from riak.transports.pool import Pool
+
+
+def test_process_local_recreated_after_fork():
+    created = []
+
+    def factory():
+        created.append(os.getpid())
+        return {'pid': os.getpid()}
+
+    proxy = ProcessLocal(factory)
+    assert proxy.get('pid') == os.getpid()
+    assert proxy.get('pid') == os.getpid()
+    assert len(created) == 1
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if proxy.get('pid') == os.getpid() else 1)
+    assert os.waitpid(pid, 0)[1] == 0
+
+
+def test_riak_nodes(monkeypatch):
+    monkeypatch.setattr(settings, 'RIAK_NODES', 'node1:8198:8187, node2')
+    assert get_riak_nodes() == [
+        {'host': 'node1', 'http_port': 8198, 'pb_port': 8187},
+        {'host': 'node2', 'http_port': int(settings.RIAK_PORT),
+         'pb_port': int(settings.RIAK_PB_PORT)}]
+
+
+def test_round_robin_on_healthy_nodes():
+    client = RiakClient(protocol='http', nodes=[{'host': 'node1'}, {'host': 'node2'},
+                                                {'host': 'node3'}])
+    assert [client._choose_node().host for i in range(4)] == ['node1', 'node2', 'node3', 'node1']
+    for i in range(10):
+        client.nodes[1].error_rate.incr(1)
+    assert [client._choose_node().host for i in range(4)] == ['node1', 'node3', 'node1', 'node3']
+
+
+def test_lazy_settings():
+    lazy_settings = Settings()
+    assert '_loaded' in lazy_settings.__dict__ and not lazy_settings._loaded
+    assert lazy_settings.DEFAULT_BUCKET_TYPE == settings.DEFAULT_BUCKET_TYPE
+    assert lazy_settings._loaded
+    assert not hasattr(lazy_settings, 'UNDEFINED_SETTING')
+
+
+def test_lazy_settings_loaded_once_for_threads(monkeypatch):
+    class SlowImportlib(object):
+        @staticmethod
+        def import_module(name):
+            time.sleep(0.05)
+            return importlib.import_module(name)
+
+    monkeypatch.setattr(conf, 'importlib', SlowImportlib)
+    lazy_settings = Settings()
+    results = []
+
+    def read_setting():
+        try:
+            results.append(lazy_settings.DEFAULT_BUCKET_TYPE)
+        except AttributeError as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=read_setting) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [settings.DEFAULT_BUCKET_TYPE] * 4
+
+
+def test_limited_riak_pool():
+    class ListPool(Pool):
+        def create_resource(self):
+            return []
+
+    pool = ListPool()
+    limit_pool(pool, 2)
+    first = pool.acquire()
+    with pool.transaction():
+        acquired = []
+        waiting = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+        waiting.start()
+        waiting.join(0.1)
+        assert not acquired
+    waiting.join(1)
+    assert acquired and len(pool.resources) == 2
+    # deleted resources free their slots too
+    pool.delete_resource(first)
+    pool.delete_resource(acquired[0])
+    with pool.transaction():
+        with pool.transaction():
+            assert len(pool.resources) == 2
+
+
+def test_fetch_many_keeps_key_order(monkeypatch):
+    from pyoko.db.adapter.db_riak import Adapter
+    from tests.models import Student
+
+    class FakeBucket(object):
+        def get(self, key):
+            # later keys return first
+            time.sleep(0.05 * (5 - int(key)))
+            return key
+
+    monkeypatch.setattr(settings, 'MULTIGET_CHUNK_SIZE', 3)
+    adapter = object.__new__(Adapter)
+    adapter.bucket = FakeBucket()
+    adapter._model_class = Student
+    t1 = time.time()
+    assert list(adapter._fetch_many(['1', '2', '3', '4'])) == ['1', '2', '3', '4']
+    # gets of a chunk run in parallel, on threads that are not started per call
+    assert time.time() - t1 < 0.4
+
+
+def test_multiget_pool_doesnt_block_exit():
+    code = ("from pyoko.db.connection import client; "
+            "client._multiget_pool.start(); print(len(client._multiget_pool._workers))")
+    env = dict(os.environ, PYOKO_SETTINGS='tests.settings')
+    output = subprocess.check_output([sys.executable, '-c', code], env=env, timeout=10)
+    assert int(output) == settings.RIAK_MULTIGET_POOL_SIZE
+
+
+def test_scan_streams_keys_without_secondary_indexes():
+    from pyoko.db.adapter.db_riak import Adapter
+    from riak import RiakError
+    from tests.models import Student
+
+    class FakeObject(object):
+        exists = True
+
+        def __init__(self, key):
+            self.key = key
+
+    class FakeBucket(object):
+        def get_index(self, *args, **kwargs):
+            raise RiakError('{error,{indexes_not_supported,riak_kv_bitcask_backend}}')
+
+        def stream_keys(self):
+            yield ['1', '2', '3']
+            yield ['4', '5']
+
+        def get(self, key):
+            return FakeObject(key)
+
+    adapter = object.__new__(Adapter)
+    adapter.bucket = FakeBucket()
+    adapter._model_class = Student
+    checkpoints = []
+    keys = [obj.key for obj in adapter.scan_objects(2, 2, on_checkpoint=checkpoints.append)]
+    assert keys == ['1', '2', '3', '4', '5']
+    assert checkpoints == [None]
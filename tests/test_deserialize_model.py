@@ -8,7 +8,9 @@
 # (GPLv3).  See LICENSE.txt for details.
 from copy import deepcopy
 from tests.data.test_data import data, clean_data
-from tests.models import Student
+from pyoko import Node, field
+from pyoko.record import get_record_class
+from tests.models import Student, Role, Employee, User
 
 
 def test_json_to_model_to_json():
@@ -40,3 +42,140 @@ def test_json_to_model_to_json_partial():
     partial_data_clean['timestamp'] = clean_value['timestamp']
     partial_data_clean['updated_at'] = clean_value['updated_at']
     assert partial_data_clean == clean_value
+
+
+def test_model_layout():
+    st = Student()
+    layout = Student._get_layout()
+    assert Student()._get_layout() is layout
+    assert st._choice_fields is layout.choice_fields
+    assert [lnk['field'] for lnk, _, _ in layout.links] == [
+        lnk['field'] for lnk in Student.get_links(is_set=False)]
+    assert set(name for name, _, _ in layout.nodes) == set(Student._nodes)
+    assert Student._instance_registry[id(st)] is st
+    # modifying links of the class drops the layout
+    Student._add_linked_model(Student, field='layout_test', lnksrc='test')
+    assert Student._layout is None
+    Student._linked_models['Student'] = [lnk for lnk in Student._linked_models['Student']
+                                         if lnk['field'] != 'layout_test']
+    Student._layout = None
+    Student._links_index = {}
+
+
+def test_get_links_index():
+    links = Student.get_links(is_set=False)
+    assert Student.get_links(is_set=False) is links
+    assert links == [lnk for lnks in Student._linked_models.values() for lnk in lnks
+                     if not lnk['is_set']]
+    Student._add_linked_model(Student, field='index_test', lnksrc='test')
+    assert Student.get_links(field='index_test')[0]['mdl'] is Student
+    assert Student.get_links(is_set=False) is not links
+    Student._linked_models['Student'] = [lnk for lnk in Student._linked_models['Student']
+                                         if lnk['field'] != 'index_test']
+    Student._layout = None
+    Student._links_index = {}
+
+
+def test_record():
+    st = Student().set_data(clean_data, from_db=True)
+    record = get_record_class(Student)(clean_data, 'record_key')
+    assert record.key == 'record_key'
+    for name in ('name', 'number', 'bio', 'join_date', 'deleted', 'deleted_at'):
+        assert getattr(record, name) == getattr(st, name)
+    assert record.Lectures == clean_data['lectures']
+    assert record.AuthInfo == clean_data['auth_info']
+    assert record.to_model().clean_value()['name'] == 'Jack'
+    try:
+        record.name = 'John'
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("records should be read-only")
+
+
+def test_record_camel_case_field():
+    class Enrollment(Node):
+        joinCode = field.String()
+
+    # stored with un_camel'ed keys
+    record = get_record_class(Enrollment)({'join_code': 'abc'})
+    assert record.joinCode == 'abc'
+
+
+def test_listnode_lazy_items():
+    st = Student().set_data(clean_data, from_db=True)
+    lectures = st.Lectures
+    assert len(lectures) == 2
+    assert lectures[1].code == 'rock101'
+    assert isinstance(lectures._items[0], dict)
+    next(iter(lectures))
+    assert len(lectures) == 2
+    lectures.add(code='new101')
+    assert len(lectures) == 3
+    assert [lecture.code for lecture in lectures] == ['math101', 'rock101', 'new101']
+    assert [lecture.code for lecture in lectures[1:]] == ['rock101', 'new101']
+    role = Role()
+    role.key = 'lalasmlmqqowqdq'
+    assert role in st.Lecturer
+    st.Lecturer.__delitem__(role.key, sync=False)
+    assert len(st.Lecturer) == 0 and role not in st.Lecturer
+
+
+def test_unchanged_nodes_not_serialized():
+    data = deepcopy(clean_data)
+    st = Student().set_data(data, from_db=True)
+    st.name = 'John'
+    clean_value = st.clean_value()
+    assert clean_value['name'] == 'John'
+    assert clean_value['lectures'][1] is data['lectures'][1]
+    assert clean_value['auth_info'] == data['auth_info']
+    assert not st.Lectures._is_dirty()
+    st.Lectures[0].code = 'math102'
+    st.AuthInfo.email = 'foo@bar.com'
+    clean_value = st.clean_value()
+    assert clean_value['lectures'][0]['code'] == 'math102'
+    assert clean_value['lectures'][1] is data['lectures'][1]
+    assert clean_value['auth_info']['email'] == 'foo@bar.com'
+    st.Lectures.add(code='new101')
+    assert st.clean_value()['lectures'][2]['code'] == 'new101'
+
+
+def test_changed_fields_in_memory():
+    st = Student().set_data(deepcopy(clean_data), from_db=True)
+    st.key = 'student_key'
+    assert st.changed_fields() == set()
+    st.name = clean_data['name']
+    assert not st.is_changed('name')
+    st.name = 'John'
+    st.AuthInfo.email = 'foo@bar.com'
+    assert st.changed_fields() == {'name', 'auth_info'}
+    st.Lectures(name='test_string')
+    assert st.is_changed('lectures')
+    st._set_clean(st.clean_value())
+    assert st.changed_fields() == set()
+    assert not st.Lectures._is_dirty()
+
+
+def test_changed_link_through_setattr():
+    emp = Employee().set_data({'usr_id': 'user_key', 'deleted': False}, from_db=True)
+    emp.setattr('key', 'employee_key')
+    assert emp.changed_fields() == set()
+    emp.setattr('usr', User(key='other_user_key'))
+    assert emp.is_changed('usr_id')
+
+
+def test_values_from_solr_converted_to_stored_formats(monkeypatch):
+    from pyoko.db.adapter.db_riak import Adapter
+
+    def exec_query(self):
+        # as returned by the protocol buffers transport
+        self._solr_cache = {'docs': [{'_yz_rk': 'key1', 'join_date': '2016-01-02T00:00:00Z',
+                                      'deleted': 'false', 'lectures.credit': ['3', '4'],
+                                      'updated_at': '2016-01-02T10:11:12.345Z'}]}
+
+    monkeypatch.setattr(Adapter, '_get_stored_fields', lambda self: {
+        'join_date', 'deleted', 'lectures.credit', 'updated_at'})
+    monkeypatch.setattr(Adapter, '_exec_query', exec_query)
+    assert Student.objects.values_list('key', 'join_date', 'deleted', 'lectures__credit',
+                                       'updated_at', from_solr=True) == [
+        ['key1', '2016-01-02T00:00:00Z', False, [3, 4], '2016-01-02T10:11:12.345000Z']]
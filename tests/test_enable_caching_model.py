@@ -8,7 +8,10 @@
 
 from tests.models import Student
 from pyoko.db.connection import cache
+from pyoko.db import cache as cache_module
+from pyoko.db.cache import cache_writer, cache_stats, CacheWriter
 import json
+import threading
 import six
 from pyoko import settings
 
@@ -50,15 +53,81 @@ class TestCase():
             except:
                 pass
 
+    def test_iteration_reads_through_cache(self):
+        if settings.ENABLE_CACHING:
+            s = Student().blocking_save()
+            cache.delete(s.key)
 
+            # cache misses should be fetched from riak and written back to the cache
+            assert [st.key for st in Student.objects.filter(key=s.key)] == [s.key]
+            cached_value = cache.get(s.key)
+            if six.PY3:
+                cached_value = cached_value.decode()
+            assert json.loads(cached_value)['deleted'] is False
 
+            s.blocking_delete()
 
+    def test_cache_writer_burst(self):
+        if settings.ENABLE_CACHING and not cache_writer.background:
+            cache_stats.reset()
+            with cache_writer.burst():
+                s = Student().save()
+                # writes are buffered till the end of the burst
+                assert not cache.get(s.key)
+                # but readers see the buffered value
+                assert Student.objects.get(s.key).key == s.key
+            assert cache.get(s.key)
+            stats = cache_stats.as_dict()
+            assert stats['flush'] == 1
+            assert stats['hit'] == 1
+            assert stats['error'] == 0
+            s.blocking_delete()
 
 
-
-
-
-
-
-
-
+class BlockingPipeline(object):
+    def __init__(self, written, release):
+        self.written = written
+        self.release = release
+        self.ops = []
+
+    def set(self, key, value, expire):
+        self.ops.append((key, value))
+
+    def delete(self, key):
+        self.ops.append((key, None))
+
+    def execute(self):
+        self.release.wait()
+        self.written.extend(self.ops)
+
+
+def test_cache_writer_serializes_flushes(monkeypatch):
+    written = []
+    pipelines = []
+    release = threading.Event()
+    started = threading.Event()
+
+    class FakeCache(object):
+        def pipeline(self, transaction=False):
+            pipelines.append(BlockingPipeline(written, release))
+            started.set()
+            return pipelines[-1]
+
+    monkeypatch.setattr(cache_module, 'cache', FakeCache())
+    writer = CacheWriter(background=False)
+    first = threading.Thread(target=writer.set, args=('key', {'deleted': False, 'v': 1}))
+    first.start()
+    started.wait()
+    second = threading.Thread(target=writer.set, args=('key', {'deleted': False, 'v': 2}))
+    second.start()
+    second.join(0.1)
+    try:
+        # second flush waits for the first one, its value is readable meanwhile
+        assert len(pipelines) == 1
+        assert writer.get_pending('key') == (True, json.dumps({'deleted': False, 'v': 2}))
+    finally:
+        release.set()
+    first.join()
+    second.join()
+    assert [json.loads(value)['v'] for key, value in written] == [1, 2]
+    assert writer.get_pending('key') == (False, None)
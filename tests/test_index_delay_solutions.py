@@ -8,8 +8,11 @@
 # (GPLv3).  See LICENSE.txt for details.
 import time
 
+import pytest
+
+from pyoko.exceptions import IndexSyncTimeout
 from .models import Student
-from pyoko.db.adapter.db_riak import BlockSave, BlockDelete
+from pyoko.db.adapter.db_riak import BlockSave, BlockDelete, IndexWaiter
 
 
 class TestCase:
@@ -54,3 +57,23 @@ class TestCase:
         assert Student.objects.count() == 0
         print("BlockDelete took %s" % (time.time() - t1))
 
+    def test_index_waiter(self):
+        Student.objects.filter().delete()
+        keys = [Student(surname='waiter', name='foo_%s' % i).save().key for i in range(5)]
+        lag = IndexWaiter(Student.objects, keys).wait()
+        assert Student.objects.filter(surname='waiter').count() == 5
+        assert IndexWaiter.stats['last_lag'] == lag
+
+        # nothing to wait for already indexed keys
+        waiter = IndexWaiter(Student.objects, keys, query_dict={'surname': 'waiter'})
+        polls = IndexWaiter.stats['polls']
+        waiter.wait()
+        assert IndexWaiter.stats['polls'] == polls + 1
+
+        for st in Student.objects.filter(surname='waiter'):
+            st.delete()
+        IndexWaiter(Student.objects, keys, deleted=True).wait()
+        assert Student.objects.filter(surname='waiter').count() == 0
+
+        with pytest.raises(IndexSyncTimeout):
+            IndexWaiter(Student.objects, ['there_is_no_such_key'], timeout=0.2).wait()
@@ -12,6 +12,7 @@ from time import sleep
 from pyoko.manage import ManagementCommands
 from .models import Person, User
 import tempfile
+import json
 import os
 
 
@@ -110,10 +111,33 @@ def test_dump_pretty():
         assert user.key in data_dumped
 
 
+def test_reindex():
+    handle, path = tempfile.mkstemp(prefix='pyoko_test_', suffix='.json')
+    os.remove(path)
+    ManagementCommands(args=['reindex', '--model', 'Person,User', '--workers', '2',
+                             '--chunk_size', '2', '--checkpoint', path])
+    with codecs.open(path) as file_:
+        checkpoints = json.load(file_)
+    assert checkpoints['Person']['done'] and checkpoints['User']['done']
+    # completed models are skipped when resumed with the same checkpoint file
+    ManagementCommands(args=['reindex', '--model', 'Person', '--raw', '--checkpoint', path])
+    ManagementCommands(args=['reindex', '--model', 'Person', '--raw', '--rate', '1000'])
+    assert Person.objects.count() > 0
+
+
 def test_apply_solr_schema():
     # TODO: Currently only tests if it's running without giving any errors, should assert something
     ManagementCommands(args=['migrate', '--model', 'Student', '--force'])
 
+def test_apply_solr_schema_parallel():
+    from pyoko.db.schema_update import SchemaUpdater
+    from pyoko.model import model_registry
+    updater = SchemaUpdater(model_registry, 'Student,TimeTable', threads=2, force=True, workers=2)
+    updater.run()
+    assert set(updater.timings) == {'Student', 'TimeTable'}
+    assert 'Student' in updater.create_report()
+
+
 def test_flush_db():
     # TODO: Currently only tests if it's running without giving any errors, should assert something
     ManagementCommands(args=['flush_model', '--model', 'Student'])
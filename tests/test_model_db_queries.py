@@ -11,7 +11,8 @@ from time import sleep
 import pytest
 from pyoko.conf import settings
 from pyoko.db.adapter.db_riak import BlockSave, BlockDelete
-from pyoko.exceptions import MultipleObjectsReturned
+from pyoko.db.instrumentation import instrumentation, Histogram, RingBuffer
+from pyoko.exceptions import MultipleObjectsReturned, NotCompatible
 from pyoko.manage import FlushDB
 from tests.data.test_data import data, clean_data
 from tests.models import Student, TimeTable, User, Role
@@ -183,6 +184,53 @@ class TestCase:
         assert st2_doc['_yz_rt'] == settings.DEFAULT_BUCKET_TYPE
         assert st2_doc['_yz_rk'] == st.key
 
+    def test_values_list_from_solr(self):
+        st = self.prepare_testbed()
+        qset = Student.objects.filter(auth_info__email=data['auth_info']['email'])
+        assert qset.values_list('key', from_solr=True) == qset.values_list('key') == [st.key]
+        assert qset.values('key', from_solr=True) == [{'key': st.key}]
+        if not settings.DEBUG:
+            # password field is neither indexed nor stored
+            with pytest.raises(NotCompatible):
+                qset.values_list('auth_info__password', from_solr=True)
+
+    def test_instrumentation(self):
+        st = self.prepare_testbed()
+        histogram = Histogram()
+        buffer = RingBuffer(size=2)
+        instrumentation.add_listener(histogram)
+        instrumentation.add_listener(buffer, events=['solr_executed'])
+        try:
+            list(Student.objects.filter(auth_info__email=data['auth_info']['email']))
+            Student.objects.filter(key=st.key).count()
+            Student.objects.filter(key=st.key).count()
+        finally:
+            instrumentation.remove_listener(histogram)
+            instrumentation.remove_listener(buffer)
+        summary = histogram.summary()
+        assert summary['query_compiled']['count'] == 3
+        assert summary['solr_executed']['count'] == 3
+        assert 'riak_get' in summary or 'cache_hit' in summary
+        assert summary['solr_executed']['p50'] <= summary['solr_executed']['max']
+        assert len(buffer.events) == 2
+        assert all(event.name == 'solr_executed' for event in buffer.events)
+        assert buffer.slowest(1)[0].data['query']
+
+    def test_compiled_query_plan_cache(self):
+        def compile(qset):
+            qset.adapter._compile_query()
+            return qset.adapter.compiled_query
+
+        assert compile(Student.objects.filter(name='Jack Black', number__gte=5)) == \
+               r'(name:Jack\ Black AND number:[5 TO *]) AND -deleted:True'
+        # same shape, served from the cached plan
+        assert compile(Student.objects.filter(name='a&&b:c', number__gte=7)) == \
+               r'(name:a\&&b\:c AND number:[7 TO *]) AND -deleted:True'
+        assert compile(Student.objects.filter(name=None)) == \
+               '(*:* -name:[* TO *]) AND -deleted:True'
+        assert compile(Student.objects.filter(key__in=['a', 'b'], deleted=True)) == \
+               '(_yz_rk:a OR _yz_rk:b) AND deleted:True'
+
     def test_lte_gte(self):
         self.prepare_testbed()
         with BlockSave(TimeTable):
@@ -193,6 +241,38 @@ class TestCase:
         assert TimeTable.objects.filter(hours__gte=4).count() == 2
         assert TimeTable.objects.filter(hours__lte=4).count() == 3
 
+    def test_iterator(self):
+        self.prepare_testbed(reset=True)
+        with BlockSave(TimeTable):
+            for i in range(7):
+                TimeTable(week_day=i, hours=3).save()
+        qset = TimeTable.objects.filter(hours=3)
+        keys = sorted(qset.values_list('key'))
+        assert [t.key for t in qset.iterator(chunk_size=2)] == keys
+        assert [key for data, key in qset.data().iterator(chunk_size=3)] == keys
+        assert len(list(qset.iterator(chunk_size=7))) == 7
+        assert qset.update(hours=4) == 7
+
+    def test_scan(self):
+        self.prepare_testbed(reset=True)
+        with BlockSave(TimeTable):
+            for i in range(5):
+                TimeTable(week_day=i, hours=5).save()
+        keys = set(TimeTable.objects.values_list('key'))
+        assert set(t.key for t in TimeTable.objects.scan(chunk_size=2)) == keys
+        checkpoints = []
+        scanned = []
+        for data, key in TimeTable.objects.data().scan(chunk_size=2,
+                                                       on_checkpoint=checkpoints.append):
+            scanned.append(key)
+        assert set(scanned) == keys
+        assert checkpoints[-1] is None
+        resumed = [key for data, key in TimeTable.objects.data().scan(chunk_size=2,
+                                                                      checkpoint=checkpoints[0])]
+        assert resumed == scanned[2:]
+        with pytest.raises(NotCompatible):
+            list(TimeTable.objects.filter(hours=5).scan())
+
     def test_lt_gt(self):
         self.prepare_testbed()
         with BlockSave(TimeTable):
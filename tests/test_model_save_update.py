@@ -9,7 +9,7 @@
 from time import sleep
 
 from pyoko.manage import FlushDB
-from pyoko.exceptions import ObjectDoesNotExist
+from pyoko.exceptions import ObjectDoesNotExist, NotCompatible
 from pyoko.db.adapter.db_riak import BlockSave
 from tests.data.test_data import data
 from .models import Student, User
@@ -87,3 +87,20 @@ class TestCase:
 
         # Cleanup
         user.delete()
+
+    def test_bulk_save(self):
+        self.prepare_testbed()
+        students = [Student(name='Bulk', number=str(i)) for i in range(20)]
+        with BlockSave(Student):
+            keys = Student.objects.bulk_create(students)
+        assert len(set(keys)) == 20
+        assert [st.key for st in students] == keys
+        assert Student.objects.filter(name='Bulk').count() == 20
+        with pytest.raises(NotCompatible):
+            Student.objects.bulk_create(students)
+
+        for st in students:
+            st.surname = 'Bulk'
+        with BlockSave(Student, query_dict={'surname': 'Bulk'}):
+            assert Student.objects.bulk_save(students) == keys
+        assert Student.objects.get(keys[0]).surname == 'Bulk'
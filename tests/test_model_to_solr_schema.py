@@ -6,8 +6,13 @@
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
+import os
+import tempfile
+
 from pyoko.conf import settings
-from pyoko.db.schema_update import SchemaUpdater
+from pyoko.db import schema_update
+from pyoko.db.reindex import Reindexer
+from pyoko.db.schema_update import SchemaUpdater, SchemaCache
 from tests.data.solr_schema import test_data_solr_fields_debug_zero, test_data_solr_fields_debug_not_zero,\
     test_data_solr_schema_debug_zero, test_data_solr_schema_debug_not_zero
 from tests.models import Student
@@ -35,3 +40,125 @@ def test_create_solr_schema():
 
     else:
         assert sorted(result) == sorted(test_data_solr_schema_debug_not_zero)
+
+
+def test_schema_cache():
+    path = tempfile.mktemp(prefix='pyoko_test_', suffix='.json')
+    fields = SchemaUpdater.get_schema_fields(Student()._collect_index_fields())
+    schema = SchemaUpdater.compile_schema(fields)
+    cache = SchemaCache(path)
+    assert not cache.is_up_to_date('default_student', schema)
+    cache.set('default_student', schema)
+    # fingerprints are persisted
+    cache = SchemaCache(path)
+    assert cache.is_up_to_date('default_student', schema)
+    assert not cache.is_up_to_date('default_student', SchemaUpdater.compile_schema(fields[1:]))
+    os.remove(path)
+
+
+class FakeBucket(object):
+    def get_property(self, name):
+        return 3
+
+    def set_property(self, name, value):
+        pass
+
+    def bucket(self, name):
+        return self
+
+
+class FakeClient(object):
+    def bucket_type(self, name):
+        return FakeBucket()
+
+    def delete_search_index(self, name):
+        pass
+
+    def create_search_schema(self, name, schema):
+        pass
+
+    def create_search_index(self, name, schema_name, n_val):
+        pass
+
+
+class FailingReindexer(object):
+    def __init__(self, models, **kwargs):
+        pass
+
+    def reindex_model(self, model):
+        return ['failed_key']
+
+
+def test_schema_not_cached_on_failed_reindex(monkeypatch):
+    monkeypatch.setattr(schema_update, 'wait_for_schema_deletion', lambda name: None)
+    monkeypatch.setattr(schema_update, 'wait_for_schema_creation', lambda name: None)
+    monkeypatch.setattr(schema_update, 'Reindexer', FailingReindexer)
+    updater = SchemaUpdater(None, 'student', 1, force=True)
+    updater.client = FakeClient()
+    updater.schema_cache = SchemaCache(tempfile.mktemp(prefix='pyoko_test_', suffix='.json'))
+    schema = SchemaUpdater.compile_schema(
+        SchemaUpdater.get_schema_fields(Student()._collect_index_fields()))
+    updater.apply_schema(schema, Student, False)
+    # re-index is retried on next migration
+    assert not updater.schema_cache.is_up_to_date(updater.get_index_name(Student), schema)
+
+
+class FakeRiakObject(object):
+    def __init__(self, data, key='key1'):
+        self.data = data
+        self.key = key
+        self.stored = False
+
+    def store(self):
+        self.stored = True
+
+
+def test_reindex_skips_empty_objects():
+    reindexer = Reindexer([Student], raw=True)
+    empty, full = FakeRiakObject(None), FakeRiakObject({'name': 'foo'})
+    for obj in (empty, full):
+        reindexer._store(Student.objects, obj)
+    assert not empty.stored and full.stored
+
+
+def test_reindex_writes_new_node_fields():
+    st = Student(name='foo')
+    st.AuthInfo.password = "pass"
+    st.Lectures(name='math', credit=3)
+    data = st.clean_value()
+    # stored before password and credit fields are defined
+    del data['auth_info']['password']
+    del data['lectures'][0]['credit']
+    obj = FakeRiakObject(data)
+    Reindexer([Student])._store(Student.objects, obj)
+    assert obj.stored
+    assert 'password' in obj.data['auth_info']
+    assert 'credit' in obj.data['lectures'][0]
+    assert obj.data['lectures'][0]['name'] == 'math'
+
+
+def test_reindex_checkpoint_not_done_on_failures(monkeypatch):
+    from pyoko.db.adapter.db_riak import Adapter
+
+    def scan_objects(self, chunk_size, concurrency, checkpoint, on_checkpoint):
+        for key in ('key1', 'key2'):
+            yield FakeRiakObject({'name': key}, key)
+            on_checkpoint(key)
+        on_checkpoint(None)
+
+    def store(self, queryset, obj):
+        if obj.key == 'key1':
+            raise ValueError(obj.key)
+
+    path = tempfile.mktemp()
+    monkeypatch.setattr(Adapter, 'scan_objects', scan_objects)
+    monkeypatch.setattr(Reindexer, '_store', store)
+    try:
+        reindexer = Reindexer([Student], workers=1, checkpoint_path=path)
+        assert reindexer.run() == {'Student': ['key1']}
+        # resumed from the start, to retry the failed key
+        assert Reindexer([Student], checkpoint_path=path).checkpoint.get('Student') == \
+            (False, None)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
@@ -6,8 +6,9 @@
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
+from copy import deepcopy
 
-
+from pyoko.conf import settings
 from tests.data.test_data import data, clean_data
 from tests.models import Student
 
@@ -87,3 +88,49 @@ def test_model_to_json_expanded():
     clean_data['timestamp'] = clean_value['timestamp']
     clean_data['updated_at'] = clean_value['updated_at']
     assert clean_data == clean_value
+
+
+class FakeRiakObject(object):
+    def __init__(self, stored, key=None, data=None):
+        self.stored = stored
+        self.key = key
+        self.data = data
+        self.vclock = None
+
+    def store(self):
+        self.stored.append((self.key, self.vclock))
+        self.vclock = 'vclock_%s' % len(self.stored)
+        return self
+
+
+class FakeBucket(object):
+    def __init__(self):
+        self.stored = []
+
+    def new(self, key=None, data=None):
+        return FakeRiakObject(self.stored, key, data)
+
+    def get(self, key):
+        raise AssertionError("%s shouldn't be fetched before storing" % key)
+
+
+def test_unchanged_save_skipped(monkeypatch):
+    for name in ('ENABLE_VERSIONS', 'ENABLE_CACHING', 'ENABLE_ACTIVITY_LOGGING'):
+        monkeypatch.setattr(settings, name, False)
+    st = Student().set_data(deepcopy(clean_data), from_db=True)
+    st.setattrs(key='student_key', _vclock='vclock_0')
+    adapter = st.objects.adapter
+    bucket = FakeBucket()
+    monkeypatch.setattr(adapter, 'bucket', bucket)
+    adapter.save_model(st)
+    assert bucket.stored == []
+    st.name = 'John'
+    adapter.save_model(st)
+    # stored with the vclock it's loaded with
+    assert bucket.stored == [('student_key', 'vclock_0')]
+    assert st._vclock == 'vclock_1'
+    adapter.save_model(st)
+    assert len(bucket.stored) == 1
+    monkeypatch.setattr(settings, 'SKIP_UNCHANGED_SAVES', False)
+    adapter.save_model(st)
+    assert bucket.stored[1] == ('student_key', 'vclock_1')
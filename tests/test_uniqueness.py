@@ -10,6 +10,7 @@ from time import sleep
 
 import pytest
 
+from pyoko.db.uniqueness import UniquenessChecker
 from pyoko.exceptions import IntegrityError
 from pyoko.manage import FlushDB
 from .models import Uniques, UniqRelation, OtherUniqRelation
@@ -45,3 +46,27 @@ class TestCase():
         sleep(1)
         with pytest.raises(IntegrityError):
             Uniques(id='a', foo_id='ae', username='foo3').save()
+
+
+def test_batch_uniqueness_check(monkeypatch):
+    queries = []
+
+    def count(self, constraint_queries):
+        # objects with "taken" values are assumed to be stored
+        queries.append(constraint_queries)
+        return sum('taken' in query for query in constraint_queries)
+
+    monkeypatch.setattr(UniquenessChecker, '_count', count)
+    checker = UniquenessChecker(Uniques.objects)
+    models = [Uniques(id='id%s' % i, foo_id='foo', username='user%s' % i) for i in range(10)]
+    checker.check_many(models)
+    assert len(queries) == 1
+    # duplicates in the batch are caught without querying
+    del queries[:]
+    with pytest.raises(IntegrityError):
+        checker.check_many(models + [Uniques(id='id3', foo_id='foo', username='user10')])
+    assert not queries
+    models[7].username = 'taken'
+    with pytest.raises(IntegrityError) as exc:
+        checker.check_many(models)
+    assert 'username' in str(exc.value) and 'taken' in str(exc.value)
@@ -131,3 +131,35 @@ def update_log_version_keys(self):
     self.last_version_keys = version_bucket.get_keys()
     # Keys list in log bucket.
     self.last_log_keys = log_bucket.get_keys()
+
+
+def test_version_and_log_stores_instrumented(monkeypatch):
+    from pyoko.db.adapter import db_riak
+    from pyoko.db.instrumentation import instrumentation, RingBuffer
+
+    class FakeObject(object):
+        key = 'fake_key'
+
+        def add_index(self, *args):
+            pass
+
+        def store(self):
+            pass
+
+    class FakeBucket(object):
+        def new(self, data):
+            return FakeObject()
+
+    monkeypatch.setattr(db_riak, 'version_bucket', FakeBucket())
+    monkeypatch.setattr(db_riak, 'log_bucket', FakeBucket())
+    role = AbstractRole()
+    role.setattr('key', 'role_key')
+    buffer = RingBuffer(size=10)
+    instrumentation.add_listener(buffer, events=['riak_store'])
+    try:
+        version_key = AbstractRole.objects.adapter._write_version({}, role)
+        AbstractRole.objects.adapter._write_log(version_key, None, None)
+    finally:
+        instrumentation.remove_listener(buffer)
+    assert [event.data['kind'] for event in buffer.events] == ['version', 'log']
+    assert all(event.model == 'AbstractRole' for event in buffer.events)